@@ -0,0 +1,66 @@
+################################################################################
+#        ______                    ______                            __        #
+#       /  _/ /____  ____ ___     / ____/___  ____  ________  ____  / /_       #
+#       / // __/ _ \/ __ `__ \   / /   / __ \/ __ \/ ___/ _ \/ __ \/ __/       #
+#     _/ // /_/  __/ / / / / /  / /___/ /_/ / / / / /__/  __/ /_/ / /_         #
+#    /___/\__/\___/_/ /_/ /_/   \____/\____/_/ /_/\___/\___/ .___/\__/         #
+#                                                         /_/                  #
+#            ______          __             __    ___                          #
+#           / ____/___ ___  / /_  ___  ____/ /___/ (_)___  ____ _              #
+#          / __/ / __ `__ \/ __ \/ _ \/ __  / __  / / __ \/ __ `/              #
+#         / /___/ / / / / / /_/ /  __/ /_/ / /_/ / / / / / /_/ /               #
+#        /_____/_/ /_/ /_/_.___/\___/\__,_/\__,_/_/_/ /_/\__, /                #
+#                                                       /____/ credit: patorjk #
+################################################################################
+
+# Proj: Item Concept Embedding (ICE)
+# File: benchmark_ann.py
+# Date: 10/18/2026
+
+import time
+from ice_lib.utility import *
+from ice_lib.preprocess import *
+from ice_lib.retrieve import *
+from ice_lib.evaluate import *
+
+#	SECTION 1: Setup.
+graph_path = "/home/LyricsRec/datasplit-700030/graph/"
+repr_path = graph_path + "all_repr/unorm_2-dir_sll_exp_top10x3.embd"
+index_path = graph_path + "all_repr/unorm_2-dir_sll_exp_top10x3.ivf.npz"
+
+# Step 0: Declare constant components.
+repr_tag = 'exp_w'
+list_num = 1024 # number of IVF inverted lists
+probe_list = [1, 2, 4, 8, 16, 32, 64]
+quo_list = [10, 50, 100]
+query_num = 1000 # number of lyric words used as queries
+
+
+#	SECTION 2: Load resources & build the index.
+repr_mat_dict = load_repr_matrices(repr_path, [repr_tag, 's'], 1)
+lyric_repr_dict = repr_mat_dict[repr_tag]
+rec_mat = repr_mat_dict['s']
+query_list = lyric_repr_dict.items[:query_num].tolist()
+
+start = time.time()
+ivf_index = generate_ivf_index(rec_mat, list_num, seed=0)
+ivf_index.save(index_path)
+print("Index built in:\t", time.time()-start, end='\n\n')
+
+
+#	SECTION 3: Compare approximate retrieval against exact retrieval.
+print("Quota:\t\tProbes:\t\tRecall@k:\tExact (s):\tIVF (s):")
+for quo in quo_list:
+    start = time.time()
+    exact_rl_list = retrieve_batch(quo, query_list, lyric_repr_dict, rec_mat)
+    exact_time = time.time()-start
+
+    for probe_num in probe_list:
+        ivf_index.probe_num = probe_num
+        start = time.time()
+        approx_rl_list = retrieve_batch(quo, query_list, lyric_repr_dict, rec_mat, ann_index=ivf_index)
+        approx_time = time.time()-start
+
+        recall = calculate_recall_at_k(exact_rl_list, approx_rl_list)
+        print("%d\t\t%d\t\t%f\t%f\t%f" % (quo, probe_num, recall, exact_time, approx_time))
+    print()
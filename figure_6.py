@@ -33,146 +33,157 @@ graph_path = "/home/LyricsRec/datasplit-700030/graph/"
 lyric_path = "/home/LyricsRec/sourcefile/lyrics-cut.json"
 latest_song_path = graph_path + "top1/post_uniq/sl_top1.edge" # top1 has the most abundant songs
 
-lyric_dict = load_lyric_dict(lyric_path, 's')
-avail_song_list = list(load_el_by_tag(latest_song_path, 's', True).keys())
+def generate_repr_path(mod, top):
+    """ Return the representation path of a mod & top setting. """
+    if mod=="w2v_":
+        fname = mod + top
+    elif mod=="sl_":
+        fname = "unorm_2-undir_" + mod + top
+    elif mod=="sll_":
+        fname = "unorm_2-undir_" + mod + top + "x3"
+    else:
+        fname = "unorm_2-dir_" + mod + top + "x3"
 
-# Step 0: Declare constant components.
-mod_list = ["rand", "km", "w2v_", "sl_", "sll_exp_"]
-top_list = ["top1", "top3", "top5", "top8", "top10"]
-quo_list = [10, 50, 100]
+    return graph_path + "all_repr_api/" + fname + ".embd"
 
 
-query_list = ['w失落', 'w心痛', 'w想念', 'w深愛', 'w難過', 'w回家', 'w房間',
-    'w海邊', 'w火車', 'w花園', 'w夕陽', 'w日出', 'w日落', 'w月亮', 'w黑夜']
+if __name__ == "__main__":
+    lyric_dict = load_lyric_dict(lyric_path, 's')
+    keyword_index = generate_keyword_index(lyric_dict) # built once for KBR & evaluation
+    avail_song_list = list(load_csr_by_tag(latest_song_path, 's', True).keys())
+    cont_index = ContainmentIndex(lyric_dict, avail_song_list, "w", keyword_index) # shared by all settings
 
-# Step 1: Generate plot label.
-label_list = ["RAND", "KBR", "AVGEMB", "BPT", "ICE (exp-3)"]
+    # Step 0: Declare constant components.
+    mod_list = ["rand", "km", "w2v_", "sl_", "sll_exp_"]
+    top_list = ["top1", "top3", "top5", "top8", "top10"]
+    quo_list = [10, 50, 100]
 
-label_dict = dict()
-label_dict["plot/synonym_label.pdf"] = (label_list, style_list)
-save_json_obj(label_dict, "plot/figure_6_label.json")
 
-# Step 2:
-stat_dict = dict()
-rand_done = False
-km_done = False
-rand_mi_p = 0
-km_mi_p = 0
+    query_list = ['w失落', 'w心痛', 'w想念', 'w深愛', 'w難過', 'w回家', 'w房間',
+        'w海邊', 'w火車', 'w花園', 'w夕陽', 'w日出', 'w日落', 'w月亮', 'w黑夜']
 
 
-for quo in quo_list:
-    print("At quota=", quo)
+    # Step 1: Generate plot label.
+    label_list = ["RAND", "KBR", "AVGEMB", "BPT", "ICE (exp-3)"]
 
-    yl = "Precision@" + str(quo)
-    path = "plot/synonym_p@" + str(quo) + ".pdf"
-    yl_list = []
-    for mod in mod_list:
-        print("At quota:mod=%s:%s" % (quo, mod))
+    label_dict = dict()
+    label_dict["plot/synonym_label.pdf"] = (label_list, style_list)
+    save_json_obj(label_dict, "plot/figure_6_label.json")
 
-        y_list = []
-        for top in top_list:
-            print("At quota:mod:top=%s:%s:%s" % (quo, mod, top))
+    # Step 2:
+    stat_dict = dict()
+    y_dict = dict() # key=(quo, mod, top) & val=micro precision
+    rand_done = False
+    km_done = False
+    rand_mi_p = 0
+    km_mi_p = 0
 
-            # Step 2: Set survey & representation paths.
-            if mod=="rand":
-                if rand_done:
-                    continue
-                else:
-                    rand_done = True
-                fname = mod
-            elif mod=="km":
-                if km_done:
-                    continue
-                else:
-                    km_done = True
-                fname = mod
-            elif mod=="w2v_":
-                fname = mod + top
-            elif mod=="sl_":
-                fname = "unorm_2-undir_" + mod + top
-            elif mod=="sll_":
-                fname = "unorm_2-undir_" + mod + top + "x3"
+    # Load LL edge lists of all top variants concurrently & only ONCE.
+    syn_spec_list = [(top, load_csr_by_tag, (graph_path + top + "/" + "post_uniq/" + "ll_" + top + "x3.edge", 'w', True)) for top in top_list]
+    syn_dict_dict = dict(load_resources(syn_spec_list))
+
+    for mod in mod_list:
+        print("At mod=", mod)
+
+        # Load each top variant's repr dicts only ONCE, parsing the next two in
+        # separate processes while the current one is evaluated, i.e. at most
+        # three variants are resident.
+        if mod!="rand" and mod!="km":
+            if mod=="sll_exp_": # SLL exp
+                repr_tag = 'exp_w'
             else:
-                fname = "unorm_2-dir_" + mod + top + "x3"
-               
-            repr_path = graph_path + "all_repr_api/" + fname + ".embd"
+                repr_tag = 'w'
 
+            repr_spec_list = [(top, load_repr_matrices, (generate_repr_path(mod, top), [repr_tag, 's'], 1)) for top in top_list]
+            repr_mat_iter = load_resources(repr_spec_list, 2, True, 2)
+        else:
+            repr_mat_iter = ((top, None) for top in top_list)
 
+        for top, repr_mat_dict in repr_mat_iter:
             #	SECTION 2: Load resources.
-            # Step 1: Set paths.
-            synonym_path = graph_path + top + "/" + "post_uniq/" + "ll_" + top + "x3.edge" 
-            syn_dict = load_el_by_tag(synonym_path, 'w', True) # load LL edge list
+            syn_dict = syn_dict_dict[top] # LL edge list
 
             # Load repr dicts.
             if mod!="rand" and mod!="km":
-                if mod=="sll_exp_": # SLL exp 
-                    repr_tag = 'exp_w'
-                else: 
-                    repr_tag = 'w'
-
-                lyric_repr_dict = load_repr_by_tag(repr_path, repr_tag, 1)
-                song_repr_dict = load_repr_by_tag(repr_path, 's', 1)
-                rec_mat = generate_indexed_matrix(list(song_repr_dict.keys()), song_repr_dict)
-
-
-            #	SECTION 3: Conduct the retrieval task.
-            rl_list = [] # list of rec list
-            for query in query_list:
-                # Step 1: Random.
-                if mod == "rand":
-                     songs = retrieve_by_random(quo, avail_song_list)
-                    
-                # Step 2: Keyword-matching.
-                elif mod == "km":
-                    songs = retrieve_by_keyword(quo, [query], avail_song_list, lyric_dict)
+                lyric_repr_dict = repr_mat_dict[repr_tag]
+                rec_mat = repr_mat_dict['s']
 
-                # Step 3: Representation, i.e. w2v, sl, sll, sll_exp, sll_nxm, w2v_exp
-                else:
-                    if mod=="sll_exp_":
-                        query = "exp_w" + query[1:] # replace 'w' tag with 'exp_w' tag
-                    if query in lyric_repr_dict: # Rec ONLY if repr exists.
-                        songs = retrieve_by_repr(quo, [query], lyric_repr_dict, rec_mat)
-                    else:
-                        songs = []
-
-                rl_list.append(songs)
+            for quo in quo_list:
+                print("At mod:top:quota=%s:%s:%s" % (mod, top, quo))
 
+                # Step 2: Run baselines only ONCE.
+                if mod=="rand":
+                    if rand_done:
+                        continue
+                    else:
+                        rand_done = True
+                elif mod=="km":
+                    if km_done:
+                        continue
+                    else:
+                        km_done = True
 
-            #	SECTION 4: Evaluate results.
-            query_num = len(query_list)
-            avail_sl_list = [avail_song_list]*query_num # list of lists of available songs
-            tp_fp_list = [quo]*query_num
-            copy_friendly = False
 
-            # 5-1: Evaluation query relevance.
-            ql_list = []
-            for q in query_list:
-                try:
-                    ql_list.append(syn_dict[q])
-                except KeyError:
-                    print("Keyword:" + q + "does NOT have synonym!", end="\n")
+                #	SECTION 3: Conduct the retrieval task.
+                rl_list = [] # list of rec list
+                if mod == "rand" or mod == "km":
+                    for query in query_list:
+                        # Step 1: Random.
+                        if mod == "rand":
+                             songs = retrieve_by_random(quo, avail_song_list)
 
-            tp_list = count_keyword_containment(ql_list, rl_list, lyric_dict, "w")
-            mi_p = calculate_micro_precision(tp_list, tp_fp_list)
+                        # Step 2: Keyword-matching.
+                        else:
+                            songs = retrieve_by_keyword(quo, [query], avail_song_list, lyric_dict, keyword_index)
 
-            y_list.append(mi_p) # top
+                        rl_list.append(songs)
 
+                # Step 3: Representation, i.e. w2v, sl, sll, sll_exp, sll_nxm, w2v_exp
+                else:
+                    if mod=="sll_exp_":
+                        repr_query_list = ["exp_w" + q[1:] for q in query_list] # replace 'w' tag with 'exp_w' tag
+                    else:
+                        repr_query_list = query_list
+                    rl_list = retrieve_batch(quo, repr_query_list, lyric_repr_dict, rec_mat) # Rec ONLY if repr exists.
+
+
+                #	SECTION 4: Evaluate results.
+                query_num = len(query_list)
+                tp_fp_list = [quo]*query_num
+                copy_friendly = False
+
+                # 5-1: Evaluation query relevance.
+                ql_list = []
+                for q in query_list:
+                    try:
+                        ql_list.append(syn_dict[q])
+                    except KeyError:
+                        print("Keyword:" + q + "does NOT have synonym!", end="\n")
+
+                tp_list = count_keyword_containment_by_index(ql_list, rl_list, cont_index)
+                mi_p = calculate_micro_precision(tp_list, tp_fp_list)
+
+                y_dict[(quo, mod, top)] = mi_p
+
+                if mod=="rand":
+                    rand_mi_p = mi_p
+                if mod=="km":
+                    km_mi_p = mi_p
+
+    for quo in quo_list:
+        yl = "Precision@" + str(quo)
+        path = "plot/synonym_p@" + str(quo) + ".pdf"
+        yl_list = []
+        for mod in mod_list:
+            # Random and keyword-matching baselines are run only ONCE.
             if mod=="rand":
-                rand_mi_p = mi_p
-            if mod=="km":
-                km_mi_p = mi_p
-
-        # Random and keyword-matching baselines are run only ONCE.
-        if mod=="rand":
-            y_list = len(top_list)*[rand_mi_p]
-        if mod=="km":
-            y_list = len(top_list)*[km_mi_p]
-        yl_list.append(y_list) # mod
-
-    stat_dict[path] = (title, xl, yl, xt_list, yl_list, style_list) # quo
-
-save_json_obj(stat_dict, "plot/figure_6_stat.json")
-
-
+                y_list = len(top_list)*[rand_mi_p]
+            elif mod=="km":
+                y_list = len(top_list)*[km_mi_p]
+            else:
+                y_list = [y_dict[(quo, mod, top)] for top in top_list]
+            yl_list.append(y_list) # mod
 
+        stat_dict[path] = (title, xl, yl, xt_list, yl_list, style_list) # quo
 
+    save_json_obj(stat_dict, "plot/figure_6_stat.json")
@@ -18,12 +18,147 @@
 # Seri: 6/6
 # Date: 03/15/2017
 # Cont:
+#       Clas:
+#           1) ContainmentIndex
 #       Func:
 #	        1) count_keyword_containment	2) calculate_micro_precision
 #	        3) calculate_micro_recall	    4) calculate_macro_precision
 #	        5) calculate_macro_recall	    6) calculate_f1_score
 #	        7) calculate_all_micro          8) calculate_all_macro
-#           9) pretty_print_eval
+#           9) pretty_print_eval            10) calculate_recall_at_k
+#           11) count_keyword_containment_by_index
+#           12) count_available_containment
+#           13) share_arrays                    14) attach_arrays
+#           15) share_indexed_matrix            16) attach_indexed_matrix
+#           17) share_containment_index         18) attach_containment_index
+#           19) init_eval_worker                20) fill_keyword_bitmaps
+#           21) evaluate_query_chunk            22) evaluate_joint_queries
+
+import os
+import concurrent.futures
+import numpy as np
+from multiprocessing import shared_memory
+from ice_lib.retrieve import IndexedMatrix, retrieve_by_repr
+
+
+class ContainmentIndex():
+    """
+    Store which songs contain each keyword as bitmaps over a fixed song id
+    space so that containment counts become bitwise operations.
+    """
+
+    def __init__(self, lyric_dict, avail_song_list, tag="", keyword_index=None):
+        """ Constructor for ContainmentIndex.
+        Param:
+            param0 [self] reference to this object.
+            param1 [dict] where key=song & val=lyric.
+            param2 [list] of available songs, i.e. songs counted as TP+FN.
+            param3 [string] tag used to de-tag keywords during matching.
+                    Default="".
+            param4 [KeywordIndex] built over param1 to find songs containing a
+                    keyword without scanning every lyric. Default=None.
+        Note:
+            1) Keyword bitmaps are built on first use and then reused by every
+                later count, e.g. across retrieval methods and quotas.
+        """
+        self.lyric_dict = lyric_dict
+        self.songs = list(lyric_dict.keys())
+        self.song_idx = {song:idx for idx, song in enumerate(self.songs)}
+        self.tag = tag
+        self.keyword_index = keyword_index
+        self.bitmap_dict = {} # key=keyword & val=packed song bitmap
+        self.avail_bitmap = self.generate_song_bitmap(avail_song_list)
+        self.avail_count_dict = {} # key=tuple of keywords & val=TP+FN
+
+    def generate_song_bitmap(self, song_list):
+        """ Generate the packed bitmap of a list of songs.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of songs with lyrics.
+        Return:
+            return1 [ndarray] of np.packbits-packed song membership.
+        """
+        mask = np.zeros(len(self.songs), dtype=bool)
+        mask[[self.song_idx[song] for song in song_list]] = True
+        return np.packbits(mask)
+
+    def generate_keyword_bitmap(self, keyword):
+        """ Generate the packed bitmap of songs whose lyrics contain a keyword
+            without caching it.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] tagged keyword.
+        Return:
+            return1 [ndarray] of np.packbits-packed song containment.
+        """
+        word = keyword[len(self.tag):]
+        if self.keyword_index is None:
+            song_list = [song for song in self.songs if word in self.lyric_dict[song]]
+        else:
+            song_list = list(self.keyword_index.count(word).keys())
+        return self.generate_song_bitmap(song_list)
+
+    def get_keyword_bitmap(self, keyword):
+        """ Build once and return the packed bitmap of songs whose lyrics
+            contain a keyword.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] tagged keyword.
+        Return:
+            return1 [ndarray] of np.packbits-packed song containment.
+        """
+        if keyword not in self.bitmap_dict:
+            self.bitmap_dict[keyword] = self.generate_keyword_bitmap(keyword)
+        return self.bitmap_dict[keyword]
+
+    def get_keywords_bitmap(self, keyword_list):
+        """ Return the packed bitmap of songs containing any of the keywords.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of tagged keywords.
+        Return:
+            return1 [ndarray] of np.packbits-packed song containment.
+        """
+        bitmap = np.zeros_like(self.avail_bitmap)
+        for keyword in keyword_list:
+            bitmap |= self.get_keyword_bitmap(keyword)
+        return bitmap
+
+    def count_containment(self, keyword_list, song_list):
+        """ Count the songs which contain any of the keywords.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of tagged keywords.
+            param2 [list] of songs with lyrics.
+        Return:
+            return1 [int] number of distinct param2 songs containing param1.
+        """
+        bitmap = self.get_keywords_bitmap(keyword_list) & self.generate_song_bitmap(song_list)
+        return int(np.unpackbits(bitmap).sum())
+
+    def count_available(self, keyword_list, exclude_list=()):
+        """ Count once and return the available songs which contain any of the
+            keywords.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of tagged keywords.
+            param2 [list] of songs NOT counted, e.g. a user's blacklist items;
+                    songs without lyrics are ignored. Default=(), i.e. none.
+        Return:
+            return1 [int] number of available songs containing param1.
+        Note:
+            1) Counts with param2 are NOT cached.
+        """
+        if len(exclude_list) > 0:
+            exclude_bitmap = self.generate_song_bitmap([song for song in exclude_list if song in self.song_idx])
+            bitmap = self.get_keywords_bitmap(keyword_list) & self.avail_bitmap & ~exclude_bitmap
+            return int(np.unpackbits(bitmap).sum())
+
+        key = tuple(keyword_list)
+        if key not in self.avail_count_dict:
+            bitmap = self.get_keywords_bitmap(keyword_list) & self.avail_bitmap
+            self.avail_count_dict[key] = int(np.unpackbits(bitmap).sum())
+        return self.avail_count_dict[key]
 
 
 def count_keyword_containment(kl_list, sl_list, lyric_dict, tag=""):
@@ -207,3 +342,336 @@ def pretty_print_all(kl_list, tp_list, tp_fp_list, tp_fn_list, copy_friendly):
     print("Micro prec:\tMicro recall:\tMicro F1:\tMacro prec:\tMacro recall:\tMacro F1:")
     print(6*("%f"+end_char) % result_tuple)
     print()
+
+
+def calculate_recall_at_k(exact_il_list, approx_il_list):
+    """ Calculate the average recall@k of approximate retrieval against exact
+        retrieval.
+    Param:
+        param1 [list] of lists of exactly retrieved items, one list per query.
+        param2 [list] of lists of approximately retrieved items.
+    Return:
+        return1 [float] average fraction of param1 items found in param2.
+    Note:
+        1) k is the length of each param1 list; empty lists are skipped.
+    """
+    recall_list = [len(set(exact) & set(approx)) / len(exact)
+            for exact, approx in zip(exact_il_list, approx_il_list) if len(exact) > 0]
+
+    return sum(recall_list) / len(recall_list)
+
+
+def count_keyword_containment_by_index(kl_list, sl_list, cont_index):
+    """ Count the number of songs which contain any of the keywords for each
+        keyword set with a ContainmentIndex.
+    Param:
+        param1 [list] of lists of keywords.
+        param2 [list] of lists retrieved songs.
+        param3 [ContainmentIndex] over the songs' lyrics.
+    Return:
+        return1 [list] of the number of songs which contain any of the keywords.
+    Note:
+        1) Same as count_keyword_containment with param3's tag, except that a
+            song repeated in a param2 list is counted once.
+    """
+    return [cont_index.count_containment(kl, sl) for kl, sl in zip(kl_list, sl_list)]
+
+
+def count_available_containment(kl_list, cont_index):
+    """ Count the number of available songs which contain any of the keywords
+        for each keyword set, i.e. TP+FN, with a ContainmentIndex.
+    Param:
+        param1 [list] of lists of keywords.
+        param2 [ContainmentIndex] over the songs' lyrics.
+    Return:
+        return1 [list] of the number of available songs which contain any of
+            the keywords.
+    """
+    return [cont_index.count_available(kl) for kl in kl_list]
+
+
+worker_dict = {} # per worker process: shared memory blocks & attached indices
+
+
+def share_arrays(array_dict):
+    """ Copy arrays into shared memory blocks.
+    Param:
+        param1 [dict] where key=array name & val=ndarray of a fixed-size dtype.
+    Return:
+        return1 [list] of SharedMemory blocks to close & unlink when done.
+        return2 [dict] of picklable handles for attach_arrays.
+    """
+    shm_list = [] # return1
+    handle = {} # return2: key=array name & val=(block name, shape, dtype)
+
+    for name, arr in array_dict.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        shm_list.append(shm)
+        handle[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    return shm_list, handle
+
+
+def attach_arrays(handle):
+    """ Attach to the shared memory blocks of a handle without copying.
+    Param:
+        param1 [dict] of handles returned by share_arrays.
+    Return:
+        return1 [list] of attached SharedMemory blocks to keep alive.
+        return2 [dict] where key=array name & val=ndarray backed by a block.
+    """
+    shm_list = [] # return1
+    array_dict = {} # return2
+
+    for name, (shm_name, shape, dtype) in handle.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shm_list.append(shm)
+        array_dict[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    return shm_list, array_dict
+
+
+def share_indexed_matrix(rec_mat):
+    """ Copy the arrays of an IndexedMatrix into shared memory blocks.
+    Param:
+        param1 [IndexedMatrix] to share.
+    Return:
+        return1 [list] of SharedMemory blocks to close & unlink when done.
+        return2 [dict] of picklable handles for attach_indexed_matrix.
+    """
+    return share_arrays({'items':rec_mat.items, 'repr_matrix':rec_mat.repr_matrix,
+            'row_norms':rec_mat.get_row_norms()})
+
+
+def attach_indexed_matrix(handle):
+    """ Rebuild an IndexedMatrix over the shared memory blocks of a handle
+        without copying.
+    Param:
+        param1 [dict] of handles returned by share_indexed_matrix.
+    Return:
+        return1 [list] of attached SharedMemory blocks to keep alive.
+        return2 [IndexedMatrix] backed by the blocks.
+    """
+    shm_list, array_dict = attach_arrays(handle)
+    rec_mat = IndexedMatrix(array_dict['items'], array_dict['repr_matrix'])
+    rec_mat.row_norms = array_dict['row_norms']
+
+    return shm_list, rec_mat
+
+
+def share_containment_index(cont_index, keyword_list):
+    """ Copy the song ids and the packed containment matrix of a set of
+        keywords into shared memory blocks.
+    Param:
+        param1 [ContainmentIndex] over the songs' lyrics.
+        param2 [list] of distinct tagged keywords to share the bitmaps of.
+    Return:
+        return1 [list] of SharedMemory blocks to close & unlink when done.
+        return2 [dict] of picklable handles for attach_containment_index.
+    Note:
+        1) Only bitmaps already built by param1 are copied; the rows of other
+            keywords are left zero for fill_keyword_bitmaps.
+    """
+    bitmaps = np.zeros((len(keyword_list), len(cont_index.avail_bitmap)), dtype=np.uint8)
+    for idx, keyword in enumerate(keyword_list):
+        if keyword in cont_index.bitmap_dict:
+            bitmaps[idx] = cont_index.bitmap_dict[keyword]
+
+    return share_arrays({'songs':np.asarray(cont_index.songs), 'keywords':np.asarray(keyword_list, dtype=str),
+            'bitmaps':bitmaps, 'avail_bitmap':cont_index.avail_bitmap})
+
+
+def attach_containment_index(handle, tag="", lyric_dict=None, keyword_index=None):
+    """ Rebuild a ContainmentIndex over the shared memory blocks of a handle.
+    Param:
+        param1 [dict] of handles returned by share_containment_index.
+        param2 [string] tag used to de-tag keywords during matching.
+                Default="".
+        param3 [dict|LyricCorpus] where key=song & val=lyric, needed only to
+                fill bitmaps. Default=None.
+        param4 [KeywordIndex] built over param3. Default=None.
+    Return:
+        return1 [list] of attached SharedMemory blocks to keep alive.
+        return2 [ContainmentIndex] whose keyword bitmaps are writable views of
+                the shared containment matrix.
+    """
+    shm_list, array_dict = attach_arrays(handle)
+
+    cont_index = ContainmentIndex.__new__(ContainmentIndex) # songs are already indexed
+    cont_index.lyric_dict = lyric_dict
+    cont_index.songs = array_dict['songs'].tolist()
+    cont_index.song_idx = {song:idx for idx, song in enumerate(cont_index.songs)}
+    cont_index.tag = tag
+    cont_index.keyword_index = keyword_index
+    cont_index.bitmap_dict = dict(zip(array_dict['keywords'].tolist(), array_dict['bitmaps']))
+    cont_index.avail_bitmap = array_dict['avail_bitmap']
+    cont_index.avail_count_dict = {}
+
+    return shm_list, cont_index
+
+
+def init_eval_worker(qr_handle, rec_handle, cont_handle, tag="", lyric_dict=None, keyword_index=None):
+    """ Attach a worker process to the shared query & item matrices and the
+        shared containment index.
+    Param:
+        param1 [dict] of handles of the query IndexedMatrix.
+        param2 [dict] of handles of the item IndexedMatrix.
+        param3 [dict] of handles of the ContainmentIndex.
+        param4 [string] tag of the ContainmentIndex. Default="".
+        param5 [dict|LyricCorpus] lyrics for fill_keyword_bitmaps.
+                Default=None.
+        param6 [KeywordIndex] built over param5. Default=None.
+    """
+    qr_shm_list, worker_dict['qr_mat'] = attach_indexed_matrix(qr_handle)
+    rec_shm_list, worker_dict['rec_mat'] = attach_indexed_matrix(rec_handle)
+    cont_shm_list, worker_dict['cont_index'] = attach_containment_index(cont_handle, tag, lyric_dict, keyword_index)
+    worker_dict['shm_list'] = qr_shm_list + rec_shm_list + cont_shm_list
+
+
+def fill_keyword_bitmaps(keyword_list, cont_index=None):
+    """ Build the bitmaps of a shard of keywords into the shared containment
+        matrix.
+    Param:
+        param1 [list] of tagged keywords shared by share_containment_index.
+        param2 [ContainmentIndex] returned by attach_containment_index.
+                Default=None, i.e. the one attached by init_eval_worker.
+    Return:
+        return1 [int] number of filled bitmaps.
+    """
+    cont_index = worker_dict['cont_index'] if cont_index is None else cont_index
+
+    for keyword in keyword_list:
+        cont_index.bitmap_dict[keyword][...] = cont_index.generate_keyword_bitmap(keyword)
+
+    return len(keyword_list)
+
+
+def evaluate_query_chunk(ut_dict_list, quota, metric="cosine", qr_mat=None, rec_mat=None, cont_index=None):
+    """ Count relevance components of a user chunk for each type of queries.
+    Param:
+        param1 [list] of dict where key=user & val=2-tuple of the list of
+            keyword queries and the list of blacklist items.
+        param2 [int] num of items to retrieve per user.
+        param3 [string] metric for retrieve_by_repr. Default="cosine".
+        param4 [IndexedMatrix] of query representations. Default=None, i.e.
+            the one attached by init_eval_worker.
+        param5 [IndexedMatrix] of item representations. Default=None, i.e.
+            the one attached by init_eval_worker.
+        param6 [ContainmentIndex] over the songs' lyrics. Default=None, i.e.
+            the one attached by init_eval_worker.
+    Return:
+        return1 [list] of 3-tuple of the lists of TP, TP+FP, and TP+FN, one
+            per query type & aligned with the users of each dict.
+    Note:
+        1) A retrieved song is relevant iff its lyric contains any of the
+            user's keywords, as in count_keyword_containment_by_index.
+        2) Blacklist items are never retrieved and are NOT counted as TP+FN.
+        3) Queries without representations are used for relevance only.
+    """
+    count_list = [] # return1
+    qr_mat = worker_dict['qr_mat'] if qr_mat is None else qr_mat
+    rec_mat = worker_dict['rec_mat'] if rec_mat is None else rec_mat
+    cont_index = worker_dict['cont_index'] if cont_index is None else cont_index
+
+    for ut_dict in ut_dict_list:
+        tp_list, tp_fp_list, tp_fn_list = [], [], []
+        for queries, black_items in ut_dict.values():
+            black_set = set(black_items)
+
+            # Step 1: Retrieve the top-k songs other than blacklist items.
+            repr_queries = [query for query in queries if query in qr_mat] # rec ONLY if repr exists
+            songs = []
+            if repr_queries:
+                songs = retrieve_by_repr(quota+len(black_set), repr_queries, qr_mat, rec_mat, metric)
+                songs = [song for song in songs if song not in black_set][:max(quota, 0)]
+
+            # Step 2: Count relevance by keyword containment.
+            tp_list.append(cont_index.count_containment(queries, songs))
+            tp_fp_list.append(quota)
+            tp_fn_list.append(cont_index.count_available(queries, black_items))
+
+        count_list.append((tp_list, tp_fp_list, tp_fn_list))
+
+    return count_list
+
+
+def evaluate_joint_queries(ut_dl_list, quota, qr_mat, rec_mat, cont_index, metric="cosine", worker_num=None):
+    """ Evaluate user chunks of joint queries in a process pool whose workers
+        share the representation matrices & the containment index, and merge
+        their counts.
+    Param:
+        param1 [list] of lists of dict returned by split_joint_queries, where
+            val=2-tuple of the list of keyword queries and the list of
+            blacklist items.
+        param2 [int] num of items to retrieve per user.
+        param3 [IndexedMatrix] of query representations.
+        param4 [IndexedMatrix] of item representations.
+        param5 [ContainmentIndex] over the songs' lyrics, ideally built over a
+            LyricCorpus and with a KeywordIndex.
+        param6 [string] metric for retrieve_by_repr. Default="cosine".
+        param7 [int] number of worker processes. Default=None, i.e. the
+            executor's.
+    Return:
+        return1 [list] of 6-tuple returned by calculate_all, one per query
+            type, over the users of all chunks; [] if param1 is empty.
+    Note:
+        1) Matrices and the containment bitmaps of every query keyword are
+            copied into shared memory once instead of pickled to every worker.
+        2) Bitmaps param5 has not built yet are built by the workers, sharded
+            by keyword, and then kept by param5. param5's lyrics & KeywordIndex
+            are pickled to each worker for this, which only re-maps a
+            LyricCorpus but copies a lyric dict.
+        3) Chunk counts are concatenated in chunk order, so the macro measures
+            equal those of a serial run of evaluate_query_chunk.
+    """
+    if len(ut_dl_list) == 0:
+        return []
+
+    type_num = len(ut_dl_list[0])
+    merged_list = [([], [], []) for _ in range(type_num)]
+    keyword_list = list(dict.fromkeys(query for ut_dict_list in ut_dl_list for ut_dict in ut_dict_list
+            for queries, _ in ut_dict.values() for query in queries)) # distinct in order
+    missing_list = [keyword for keyword in keyword_list if keyword not in cont_index.bitmap_dict]
+    shard_size = max(1, -(-len(missing_list) // (4*(worker_num or os.cpu_count() or 1))))
+    lyric_args = (cont_index.lyric_dict, cont_index.keyword_index) if missing_list else (None, None)
+
+    shm_list = []
+    try:
+        qr_shm_list, qr_handle = share_indexed_matrix(qr_mat)
+        shm_list += qr_shm_list
+        rec_shm_list, rec_handle = share_indexed_matrix(rec_mat)
+        shm_list += rec_shm_list
+        cont_shm_list, cont_handle = share_containment_index(cont_index, keyword_list)
+        shm_list += cont_shm_list
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=worker_num, initializer=init_eval_worker,
+                initargs=(qr_handle, rec_handle, cont_handle, cont_index.tag) + lyric_args) as executor:
+            # Step 1: Build the missing keyword bitmaps shard by shard.
+            future_list = [executor.submit(fill_keyword_bitmaps, missing_list[start:start+shard_size])
+                    for start in range(0, len(missing_list), shard_size)]
+            for future in future_list:
+                future.result()
+
+            # Step 2: Count relevance components chunk by chunk.
+            future_list = [executor.submit(evaluate_query_chunk, ut_dict_list, quota, metric)
+                    for ut_dict_list in ut_dl_list]
+            for future in future_list: # merge in chunk order
+                for merged, counts in zip(merged_list, future.result()):
+                    for merged_counts, chunk_counts in zip(merged, counts):
+                        merged_counts.extend(chunk_counts)
+
+        # Step 3: Keep the filled bitmaps for later runs.
+        shm_name, shape, dtype = cont_handle['bitmaps']
+        shm = next(shm for shm in cont_shm_list if shm.name == shm_name)
+        bitmaps = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        for idx in range(len(keyword_list)):
+            if keyword_list[idx] not in cont_index.bitmap_dict:
+                cont_index.bitmap_dict[keyword_list[idx]] = bitmaps[idx].copy()
+        del bitmaps # release the view before the block is closed
+    finally:
+        for shm in shm_list:
+            shm.close()
+            shm.unlink()
+
+    return [calculate_all(*merged) for merged in merged_list]
@@ -18,14 +18,723 @@
 # Seri: 2/6
 # Date: 03/15/2016
 # Cont:
+#	Clas:
+#		1) Vocabulary                       2) CSRGraph
+#		3) LyricCorpus                      4) SongMetadataStore
+#		5) ParseCache                       6) TfidfMatrix
 #	Func:
 #		1) load_el_by_tag                   2) load_song_metadata_dict
 #		3) load_lyric_dict                  4) join_dictionary
 #		5) load_song_tfidf_dict             6) filter_song_tfidf_dict
 #		7) generate_global_tfidf_dict       8) load_repr_by_tag
+#		9) convert_repr_to_npy              10) load_repr_by_memmap
+#		11) load_repr_matrices              12) load_csr_by_tag
+#		13) convert_lyric_to_corpus         14) load_lyric_corpus
+#		15) load_song_metadata_store        16) cache_parse
+#		17) set_parse_cache                 18) generate_relation_matrix
+#		19) join_relation_matrix            20) load_song_tfidf_matrix
+#		21) filter_song_tfidf_matrix        22) load_resources
+#		23) calculate_graph_stats           24) calculate_all_graph_stats
+#		25) build_expanded_graph            26) generate_global_tfidf_rank
 
+import os
+import sys
+import concurrent.futures
 import json
+import pickle
+import hashlib
+import marshal
+import functools
+import threading
+import numpy as np
+from scipy import sparse
+from array import array
+from itertools import islice
+from collections import OrderedDict
+from collections.abc import Mapping
 
+class Vocabulary():
+    """
+    Intern tagged names, e.g. 'w失落', 'exp_w失落' & 's12345', as dense int32
+    ids which can be shared by all loaders.
+    """
+
+    def __init__(self, tag_list=("exp_w", "w", "s")):
+        """ Constructor for Vocabulary.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of tags prefixing names. Default=("exp_w","w","s").
+        """
+        self.tag_list = sorted(tag_list, key=len, reverse=True) # longest 1st
+        self.tokens = [] # key=id & val=tagged name
+        self.token_idx = {} # key=tagged name & val=id
+        self.tag_ids = array('b') # key=id & val=index in tag_list, -1=no tag
+        self.trans_dict = {} # key=(src tag, dst tag) & val=id map
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.token_idx
+
+    def add(self, token):
+        """ Return the id of a tagged name, adding it if new.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] tagged name.
+        Return:
+            return1 [int] id of param1.
+        """
+        idx = self.token_idx.get(token)
+        if idx is None:
+            idx = len(self.tokens)
+            self.token_idx[token] = idx
+            self.tokens.append(token)
+            tag_id = -1
+            for tid, tag in enumerate(self.tag_list):
+                if token[:len(tag)] == tag:
+                    tag_id = tid
+                    break
+            self.tag_ids.append(tag_id)
+        return idx
+
+    def add_tagged(self, tag, name):
+        """ Return the id of a name under a tag, adding it if new.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] tag.
+            param2 [string] untagged name.
+        Return:
+            return1 [int] id of param1 + param2.
+        """
+        return self.add(tag + name)
+
+    def encode(self, tokens, add=True):
+        """ Convert tagged names to ids.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of tagged names.
+            param2 [bool] whether to add unknown names or map them to -1.
+                    Default=True.
+        Return:
+            return1 [ndarray] of int32 ids.
+        """
+        if add:
+            return np.array([self.add(token) for token in tokens], dtype=np.int32)
+        return np.array([self.token_idx.get(token, -1) for token in tokens], dtype=np.int32)
+
+    def decode(self, ids):
+        """ Convert ids to tagged names.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list|ndarray] of ids.
+        Return:
+            return1 [list] of tagged names.
+        """
+        return [self.tokens[idx] for idx in ids]
+
+    def get_tag(self, idx):
+        """ Return the tag of an id, or "" if untagged.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] id.
+        Return:
+            return1 [string] tag.
+        """
+        tag_id = self.tag_ids[idx]
+        return self.tag_list[tag_id] if tag_id >= 0 else ""
+
+    def get_name(self, idx):
+        """ Return the untagged name of an id.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] id.
+        Return:
+            return1 [string] untagged name.
+        """
+        return self.tokens[idx][len(self.get_tag(idx)):]
+
+    def translate(self, ids, src_tag, dst_tag):
+        """ Map ids of names under one tag to ids of the same names under
+            another tag, e.g. 'w失落' to 'exp_w失落'.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of ids tagged by param2.
+            param2 [string] source tag.
+            param3 [string] destination tag.
+        Return:
+            return1 [ndarray] of int32 ids tagged by param3, -1 if missing.
+        Note:
+            1) The id map is built once per tag pair and rebuilt only after
+                the vocabulary grows.
+        """
+        key = (src_tag, dst_tag)
+        if key not in self.trans_dict or len(self.trans_dict[key]) != len(self.tokens):
+            src_tid = self.tag_list.index(src_tag)
+            id_map = np.full(len(self.tokens), -1, dtype=np.int32)
+            for idx in np.flatnonzero(np.frombuffer(self.tag_ids, dtype=np.int8) == src_tid).tolist():
+                id_map[idx] = self.token_idx.get(dst_tag + self.tokens[idx][len(src_tag):], -1)
+            self.trans_dict[key] = id_map
+        return self.trans_dict[key][np.asarray(ids)]
+
+
+class CSRGraph():
+    """
+    Store tagged_node-associated_node adjacency in compressed sparse row (CSR)
+    form over integer node ids, with a dict-like view by node name.
+    """
+
+    def __init__(self, vocab, keys, offsets, neighbors):
+        """ Constructor for CSRGraph.
+        Param:
+            param0 [self] reference to this object.
+            param1 [Vocabulary] of node names indexed by node id.
+            param2 [ndarray] of ids of the tagged nodes, one per row.
+            param3 [ndarray] of int32 offsets s.t. the assoc nodes of row i are
+                    param4[param3[i]:param3[i+1]].
+            param4 [ndarray] of int32 assoc node ids.
+        """
+        self.vocab = vocab
+        self.key_ids = np.asarray(keys, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.key_idx = {vocab.tokens[node_id]:row for row, node_id in enumerate(self.key_ids.tolist())}
+
+    def __len__(self):
+        return len(self.key_ids)
+
+    def __contains__(self, node):
+        return node in self.key_idx
+
+    def __iter__(self):
+        return iter(self.key_idx)
+
+    def __getitem__(self, node):
+        """ Dict-like access to a tagged node's list of assoc nodes, as in
+            the dict returned by load_el_by_tag.
+        """
+        return self.vocab.decode(self.get_neighbor_ids(self.key_idx[node]))
+
+    def keys(self):
+        return self.key_idx.keys()
+
+    def values(self):
+        return (self[node] for node in self.key_idx)
+
+    def items(self):
+        return ((node, self[node]) for node in self.key_idx)
+
+    def get_neighbor_ids(self, row):
+        """ Return the assoc node ids of a row.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] row, i.e. index of the tagged node in self.key_ids.
+        Return:
+            return1 [ndarray] of int32 assoc node ids.
+        """
+        return self.neighbors[self.offsets[row]:self.offsets[row+1]]
+
+    def get_degrees(self):
+        """ Return the number of assoc nodes of every row.
+        Param:
+            param0 [self] reference to this object.
+        Return:
+            return1 [ndarray] of int32 degrees aligned with self.key_ids.
+        """
+        return np.diff(self.offsets)
+
+    def get_adjacency(self, node_num=None):
+        """ Return the adjacency as a square sparse matrix over node ids.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] number of node ids. Default=None, i.e. the vocabulary
+                    size.
+        Return:
+            return1 [sparse.csr_matrix] of int32 ones where row=tagged node id
+                    & col=assoc node id.
+        """
+        if node_num is None:
+            node_num = len(self.vocab)
+        rows = np.repeat(self.key_ids, self.get_degrees())
+        return sparse.csr_matrix((np.ones(len(self.neighbors), dtype=np.int32),
+                (rows, self.neighbors)), shape=(node_num, node_num))
+
+
+class LyricCorpus(Mapping):
+    """
+    Read-only song-lyric mapping over a memory-mapped UTF-8 corpus written by
+    convert_lyric_to_corpus, decoding a lyric only when it is accessed.
+    """
+
+    def __init__(self, path):
+        """ Constructor for LyricCorpus.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] path prefix of the corpus files.
+        """
+        self.path = path
+        self.songs = np.load(path + ".keys.npy", mmap_mode='r') # sorted songs
+        self.offsets = np.load(path + ".idx.npy", mmap_mode='r')
+        if self.offsets[-1] > 0:
+            self.buffer = np.memmap(path + ".bin", dtype=np.uint8, mode='r')
+        else: # an empty file cannot be mapped
+            self.buffer = np.empty(0, dtype=np.uint8)
+
+    def __reduce__(self): # re-map instead of pickling the pages
+        return (LyricCorpus, (self.path,))
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs.tolist())
+
+    def __getitem__(self, song):
+        """ Dict-like access to a song's lyric, as in the dict returned by
+            load_lyric_dict.
+        """
+        idx = int(np.searchsorted(self.songs, song))
+        if idx >= len(self.songs) or self.songs[idx] != song:
+            raise KeyError(song)
+        return self.buffer[self.offsets[idx]:self.offsets[idx+1]].tobytes().decode('utf-8')
+
+
+class SongMetadataStore(Mapping):
+    """
+    Read-only song-metadata mapping which records the byte offset of each
+    song's line and decodes a line only when it is accessed; close it, or use
+    it in a with statement, to release the file.
+    """
+
+    def __init__(self, path, tag, songs, offsets):
+        """ Constructor for SongMetadataStore.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] path to the song-metadata file.
+            param2 [string] tag prefixed to song ID.
+            param3 [ndarray] of sorted songs.
+            param4 [ndarray] of line byte offsets aligned with param3.
+        """
+        self.path = path
+        self.tag = tag
+        self.songs = songs
+        self.offsets = offsets
+        self.file = None # opened on first access
+        self.lock = threading.Lock() # guards the shared seek & readline
+        self.column_dict = {} # key=field index & val=column of the field
+
+    def __reduce__(self): # reopen instead of pickling the file handle
+        return (SongMetadataStore, (self.path, self.tag, self.songs, self.offsets))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Close the metadata file, which is reopened on the next access.
+        Param:
+            param0 [self] reference to this object.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs.tolist())
+
+    def __getitem__(self, song):
+        """ Dict-like access to a song's metadata, as in the dict returned by
+            load_song_metadata_dict.
+        """
+        idx = int(np.searchsorted(self.songs, song))
+        if idx >= len(self.songs) or self.songs[idx] != song:
+            raise KeyError(song)
+        return self.decode_row(idx)
+
+    def decode_row(self, idx):
+        """ Read and decode the metadata line of a song.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] index of the song in self.songs.
+        Return:
+            return1 [list] of metadata items, see load_song_metadata_dict.
+        Note:
+            1) Safe to call from several threads.
+        """
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'rb')
+            self.file.seek(int(self.offsets[idx]))
+            line = self.file.readline().decode('utf-8')
+        if line.endswith('\r\n'): # universal newline as in text mode
+            line = line[:-2] + '\n'
+
+        metadata = line.split('\t') # metadata delimiter='\t'
+        metadata[6] = metadata[6].split(',') # genere delimiter = ','
+        return metadata[1:]
+
+    def get_column(self, field):
+        """ Decode once and return one metadata field of every song.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] index of the field in a metadata item list.
+        Return:
+            return1 [ndarray] of the field aligned with self.songs.
+        Note:
+            1) Meant for filtering songs by a field without a metadata dict.
+        """
+        if field not in self.column_dict:
+            column = [self.decode_row(idx)[field] for idx in range(len(self.songs))]
+            self.column_dict[field] = np.array(column, dtype=object)
+        return self.column_dict[field]
+
+
+CACHE_VERSION = 1 # bump to invalidate every cached parse
+
+
+class ParseCache():
+    """
+    Cache parsed loader results on disk, keyed by the source file's path,
+    size & mtime, the loader code and arguments, and CACHE_VERSION, with an
+    optional in-process LRU on top.
+    """
+
+    def __init__(self, cache_dir, mem_budget=0, disk_budget=8*1024**3):
+        """ Constructor for ParseCache.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] directory to store pickled results, or None to
+                    cache in process only.
+            param2 [int] estimated bytes of results kept referenced by the
+                    in-process LRU. Default=0, i.e. no LRU.
+            param3 [int] bytes of pickled results kept in param1; the least
+                    recently used files are deleted beyond it. Default=8GiB.
+        Note:
+            1) The LRU keeps returned results alive, so a non-zero param2
+                raises the resident memory of callers by up to param2.
+        """
+        self.cache_dir = cache_dir
+        self.mem_budget = mem_budget
+        self.disk_budget = disk_budget
+        self.lru = OrderedDict() # key=cache key & val=2-tuple of result & size
+        self.mem_size = 0
+        self.lock = threading.Lock() # guards the LRU & disk eviction
+
+    def generate_key(self, loader, path, args, kwargs):
+        """ Generate the cache key of a loader call.
+        Param:
+            param0 [self] reference to this object.
+            param1 [function] loader.
+            param2 [string] path to the loaded file.
+            param3 [tuple] of the other positional loader arguments.
+            param4 [dict] of keyword loader arguments.
+        Return:
+            return1 [string] hex digest identifying the call and file state.
+        Note:
+            1) The loader's compiled code is part of the key, so editing a
+                loader invalidates its cached results; bump CACHE_VERSION when
+                only a helper it calls changes.
+        """
+        stat = os.stat(path)
+        code_hash = hashlib.sha1(marshal.dumps(loader.__code__)).hexdigest()
+        call = (CACHE_VERSION, loader.__name__, code_hash, os.path.abspath(path),
+                stat.st_size, stat.st_mtime_ns, args, sorted(kwargs.items()))
+        return hashlib.sha1(repr(call).encode('utf-8')).hexdigest()
+
+    def estimate_size(self, result):
+        """ Estimate the bytes held by a result without serializing it.
+        Param:
+            param0 [self] reference to this object.
+            param1 result of a loader.
+        Return:
+            return1 [int] estimated bytes, counting arrays by nbytes and
+                    memory-mapped arrays as 0.
+        """
+        size = 0 # return1
+        seen = set()
+        stack = [result]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            if isinstance(obj, np.memmap):
+                continue
+            elif isinstance(obj, np.ndarray):
+                size += obj.nbytes if obj.dtype != object else sys.getsizeof(obj)
+                if obj.dtype == object:
+                    stack.extend(obj.ravel().tolist())
+            elif isinstance(obj, dict):
+                size += sys.getsizeof(obj)
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                size += sys.getsizeof(obj)
+                stack.extend(obj)
+            elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+                size += sys.getsizeof(obj)
+                stack.extend(vars(obj).values())
+            else:
+                size += sys.getsizeof(obj)
+        return size
+
+    def evict_disk(self):
+        """ Delete the least recently used cache files beyond the disk budget.
+        Param:
+            param0 [self] reference to this object.
+        """
+        entry_list = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError: # deleted by another loader
+                    continue
+                entry_list.append((stat.st_mtime, stat.st_size, name))
+
+        disk_size = sum(size for _, size, _ in entry_list)
+        for _, size, name in sorted(entry_list): # oldest first
+            if disk_size <= self.disk_budget:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            disk_size -= size
+
+    def load(self, loader, path, args, kwargs):
+        """ Return a cached loader result, parsing and caching it on a miss.
+        Param:
+            param0 [self] reference to this object.
+            param1 [function] loader.
+            param2 [string] path to the loaded file.
+            param3 [tuple] of the other positional loader arguments.
+            param4 [dict] of keyword loader arguments.
+        Return:
+            return1 result of param1.
+        Note:
+            1) Results in the LRU are shared by callers, so do NOT mutate them.
+            2) Safe to call from several threads; a key missed by several
+                threads at once is parsed by each of them.
+        """
+        key = self.generate_key(loader, path, args, kwargs)
+
+        # Step 1: Look up the in-process LRU.
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key][0]
+
+        # Step 2: Look up the disk cache, parsing on a miss.
+        size = None
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, key + ".pkl")
+            try:
+                with open(cache_path, 'rb') as f:
+                    print("Loading cached:\t", path, end='\n\n')
+                    result = pickle.load(f)
+                    size = f.tell()
+                os.utime(cache_path) # mark as recently used for evict_disk
+            except (OSError, pickle.UnpicklingError, EOFError):
+                size = None
+        if size is None:
+            result = loader(path, *args, **kwargs)
+            if self.mem_budget <= 0 and cache_path is None:
+                return result # nothing to cache
+            if cache_path is not None:
+                try: # stream to a per-thread file, then rename atomically
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    tmp_path = cache_path + "." + str(os.getpid()) + "." + str(threading.get_ident())
+                    with open(tmp_path, 'wb') as f:
+                        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        size = f.tell()
+                    os.replace(tmp_path, cache_path)
+                    with self.lock:
+                        self.evict_disk()
+                except OSError:
+                    size = None
+
+        # Step 3: Keep the result in the LRU within the memory budget.
+        if self.mem_budget <= 0:
+            return result
+        if size is None:
+            size = self.estimate_size(result)
+        with self.lock:
+            if size <= self.mem_budget and key not in self.lru:
+                self.lru[key] = (result, size)
+                self.mem_size += size
+                while self.mem_size > self.mem_budget:
+                    _, (_, evicted_size) = self.lru.popitem(last=False)
+                    self.mem_size -= evicted_size
+
+        return result
+
+
+class TfidfMatrix():
+    """
+    Store song-word tfidf scores as a sparse song-by-word CSR matrix with a
+    dict-like view by song.
+    """
+
+    def __init__(self, songs, words, score_mat):
+        """ Constructor for TfidfMatrix.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of songs indexing param3 rows.
+            param2 [list] of words indexing param3 columns.
+            param3 [sparse.csr_matrix] of tfidf scores whose rows keep the
+                    words in their original order.
+        """
+        self.songs = songs
+        self.song_idx = {song:idx for idx, song in enumerate(songs)}
+        self.words = words
+        self.word_idx = {word:idx for idx, word in enumerate(words)}
+        self.score_mat = score_mat
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, song):
+        return song in self.song_idx
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, song):
+        """ Dict-like access to a song's 2-tuple of the list of words and the
+            list of scores, as in the dict returned by load_song_tfidf_dict.
+        """
+        return self.get_row(self.song_idx[song])
+
+    def keys(self):
+        return self.song_idx.keys()
+
+    def values(self):
+        return (self.get_row(idx) for idx in range(len(self.songs)))
+
+    def items(self):
+        return ((song, self.get_row(idx)) for idx, song in enumerate(self.songs))
+
+    def get_row(self, idx):
+        """ Return the words and scores of a row.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] row index.
+        Return:
+            return1 [tuple] of the list of words and the list of scores.
+        """
+        start, end = self.score_mat.indptr[idx], self.score_mat.indptr[idx+1]
+        words = [self.words[w_idx] for w_idx in self.score_mat.indices[start:end]]
+        return (words, self.score_mat.data[start:end].tolist())
+
+    def filter_words(self, word_mask):
+        """ Keep only the masked words and the songs left with any word.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of bool over word columns.
+        Return:
+            return1 [TfidfMatrix] of the kept songs & words, in the same order.
+        """
+        score_mat = self.score_mat
+        keep = word_mask[score_mat.indices]
+        rows = np.repeat(np.arange(len(self.songs)), np.diff(score_mat.indptr))[keep]
+        counts = np.bincount(rows, minlength=len(self.songs))
+
+        song_mask = counts > 0
+        indptr = np.concatenate([[0], np.cumsum(counts[song_mask])])
+        filt_mat = sparse.csr_matrix((score_mat.data[keep], score_mat.indices[keep], indptr),
+                shape=(int(song_mask.sum()), len(self.words)))
+        songs = [song for song, kept in zip(self.songs, song_mask.tolist()) if kept]
+
+        return TfidfMatrix(songs, self.words, filt_mat)
+
+    def get_global_scores(self):
+        """ Sum each word's tfidf scores across all songs.
+        Param:
+            param0 [self] reference to this object.
+        Return:
+            return1 [ndarray] of global tfidf scores over word columns.
+        """
+        return np.bincount(self.score_mat.indices, weights=self.score_mat.data,
+                minlength=len(self.words))
+
+    def generate_global_tfidf_dict(self):
+        """ Generate a dictionary of lyrical word and its global tfidf score.
+        Param:
+            param0 [self] reference to this object.
+        Return:
+            return1 [dict] as returned by generate_global_tfidf_dict.
+        """
+        used = np.bincount(self.score_mat.indices, minlength=len(self.words)) > 0
+        global_scores = self.get_global_scores()
+        return {self.words[idx]:global_scores[idx] for idx in np.flatnonzero(used).tolist()}
+
+    def get_top_words(self, n):
+        """ Extract each song's top-n tfidf words.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] number of words per song.
+        Return:
+            return1 [list] of lists of words ordered descendingly by score,
+                    aligned with self.songs; ties keep the original order.
+        """
+        tw_list = [] # return1
+        indptr, indices, data = self.score_mat.indptr, self.score_mat.indices, self.score_mat.data
+        for idx in range(len(self.songs)):
+            start, end = indptr[idx], indptr[idx+1]
+            top = np.argsort(-data[start:end], kind='stable')[:max(n, 0)]
+            tw_list.append([self.words[w_idx] for w_idx in indices[start:end][top]])
+        return tw_list
+
+
+parse_cache = ParseCache(os.environ.get("ICE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ice_lib")))
+
+
+def set_parse_cache(cache_dir, mem_budget=0, disk_budget=8*1024**3):
+    """ Configure the cache used by loaders decorated with cache_parse.
+    Param:
+        param1 [string] directory to store pickled results, or None to cache in
+                process only.
+        param2 [int] estimated bytes of results kept in the in-process LRU.
+                Default=0, i.e. no LRU.
+        param3 [int] bytes of pickled results kept in param1. Default=8GiB.
+    Note:
+        1) By default results are cached on disk only, in $ICE_CACHE_DIR or
+            ~/.cache/ice_lib, capped at 8GiB by deleting the least recently
+            used files; call set_parse_cache(None) to disable caching.
+    """
+    global parse_cache
+    parse_cache = ParseCache(cache_dir, mem_budget, disk_budget)
+
+
+def cache_parse(loader):
+    """ Decorate a loader whose 1st argument is a file path so that its result
+        is served from parse_cache.
+    Param:
+        param1 [function] loader.
+    Return:
+        return1 [function] caching loader.
+    Note:
+        1) Calls with a shared Vocabulary bypass the cache, as they must
+            register names in the vocabulary.
+    """
+    @functools.wraps(loader)
+    def cached_loader(path, *args, **kwargs):
+        if any(isinstance(arg, Vocabulary) for arg in list(args) + list(kwargs.values())):
+            return loader(path, *args, **kwargs)
+        return parse_cache.load(loader, path, args, kwargs)
+
+    return cached_loader
+
+
+@cache_parse
 def load_el_by_tag(path, tag, directed):
     """ Load and return a tagged_node-associated_node dictionary.
     Param:
@@ -36,10 +745,14 @@ def load_el_by_tag(path, tag, directed):
         return1 [dict] where key=tagged node & val=list of assoc nodes.
     """
     ta_dict = {} # return1
+    ta_set = set() # (tagged node, assoc node) pairs already added
 
     print("Loading edge list:\t",path)
     def add_tagged_assoc(tagged, assoc): # update tagged_node-assoc_node dict
-        if tagged in ta_dict and assoc not in ta_dict[tagged]:
+        if (tagged, assoc) in ta_set: # skip duplicated edges
+            return
+        ta_set.add((tagged, assoc))
+        if tagged in ta_dict:
             ta_dict[tagged].append(assoc)
         else:
             ta_dict[tagged] = [assoc]
@@ -65,6 +778,7 @@ def load_el_by_tag(path, tag, directed):
     return ta_dict
 
 
+@cache_parse
 def load_song_metadata_dict(path, tag):
     """ Load and return a song-metadata dictionary.
     Param:
@@ -91,6 +805,7 @@ def load_song_metadata_dict(path, tag):
     return metadata_dict
 
 
+@cache_parse
 def load_lyric_dict(path, tag):
     """ Load and return a song-lyric dictionary.
     Param:
@@ -111,31 +826,39 @@ def load_lyric_dict(path, tag):
     return lyric_dict
 
 
-def join_dictionary(item12_dict, item23_dict):
+def join_dictionary(item12_dict, item23_dict, weighted=False):
     """ Join an item1-item2 dictionary to an item2-item3 dictionary to
         form and return an item1-item3 dictionary.
     Param:
         param1 [dict] where key=item1 & val=list of item2
         param2 [dict] where key=item2 & val=list of itme3
+        param3 [bool] whether to pair each item3 with its number of item2
+                paths. Default=False.
     Return:
-        return1 [dict] where key=itme1 & val=list of item3.
+        return1 [dict] where key=itme1 & val=list of item3, or list of 2-tuples
+                of item3 and path count if param3.
+    Note:
+        1) Computed as one sparse boolean matrix product, see
+            join_relation_matrix.
+        2) item3 lists are ordered by first appearance in param2.
     """
     item13_dict = {} # return1
-    
-    for item1 in item12_dict:
-        item2_list = item12_dict[item1]
-        for item2 in item2_list:
-            if item2 in item23_dict:
-                if item1 not in item13_dict:
-                    item13_dict[item1] = item23_dict[item2]
-                else:
-                    item13_dict[item1] += item23_dict[item2]
 
-                item13_dict[item1] = list(set(item13_dict[item1])) # remove dup
+    # Step 1: Join the relations as sparse matrices.
+    item13_mat, item1_vocab, item3_vocab, joinable = join_relation_matrix(item12_dict, item23_dict)
+
+    # Step 2: Convert matrix rows back to item lists.
+    for row in np.flatnonzero(joinable).tolist():
+        start, end = item13_mat.indptr[row], item13_mat.indptr[row+1]
+        item3_list = item3_vocab.decode(item13_mat.indices[start:end])
+        if weighted:
+            item3_list = list(zip(item3_list, item13_mat.data[start:end].tolist()))
+        item13_dict[item1_vocab.tokens[row]] = item3_list
         
     return item13_dict
 
 
+@cache_parse
 def load_song_tfidf_dict(path, tag):
     """ Load and return a dictionary where key=song & val=2-tuple of the list of
         lyric keywords and the list of associated tfidf scores.
@@ -178,7 +901,11 @@ def filter_song_tfidf_dict(st_dict, sl_dict):
         3) In-program filtering of the tfidf dict eliminates saving tailor-made
             tfidf dict files for diff SL graphs.
         4) @@@ should we support "exp_w"?
+        5) A TfidfMatrix param1 is filtered by filter_song_tfidf_matrix.
     """
+    if isinstance(st_dict, TfidfMatrix):
+        return filter_song_tfidf_matrix(st_dict, sl_dict)
+
     tfidf_dict = {} # return1
     
     # Step 1: Collect valid lyric words from the current song-lyric graph.
@@ -207,7 +934,12 @@ def generate_global_tfidf_dict(st_dict):
     Return:
         return1 [dict] where key=keyword & val=tfidf score summed across all
         songs.
+    Note:
+        1) A TfidfMatrix param1 is summed by one column reduction.
     """
+    if isinstance(st_dict, TfidfMatrix):
+        return st_dict.generate_global_tfidf_dict()
+
     global_tfidf_dict = {} # key=word & val=global tfidf score
     
     for (words,scores) in st_dict.values():
@@ -220,6 +952,26 @@ def generate_global_tfidf_dict(st_dict):
     return global_tfidf_dict
 
 
+def generate_global_tfidf_rank(st_dict):
+    """ Rank lyrical words by their tfidf scores summed across all songs.
+    Param:
+        param1 [dict|TfidfMatrix] where key=song & val=2-tuple of the list of
+                lyric words and the list of assoc tfidf scores.
+    Return:
+        return1 [dict] where key=keyword & val=int rank, 0 for the highest
+                global tfidf score.
+    Note:
+        1) Ties are ranked by the order of words in generate_global_tfidf_dict.
+    """
+    tfidf_dict = generate_global_tfidf_dict(st_dict)
+    order = np.argsort(-np.fromiter(tfidf_dict.values(), dtype=np.float64, count=len(tfidf_dict)), kind='stable')
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+
+    return dict(zip(tfidf_dict.keys(), ranks.tolist()))
+
+
+@cache_parse
 def load_repr_by_tag(path, tag, header=0):
     """ Load and return a tagged_data-representation dictionary.
     Param:
@@ -233,7 +985,7 @@ def load_repr_by_tag(path, tag, header=0):
 
     print("Loading repr file:\t", path)
     with open(path) as f: 
-        for i, line in enumerate(f.readlines()[header:]):
+        for line in islice(f, header, None): # stream instead of readlines()
             tagged = line.split(" ")[0]
             if tagged[:len(tag)] == tag:
                 tr_dict[tagged] = line.strip().split(" ")[1:]
@@ -243,3 +995,627 @@ def load_repr_by_tag(path, tag, header=0):
     return tr_dict
 
 
+
+
+def convert_repr_to_npy(path, out_path, tag_list, header=0):
+    """ Convert a repr file to a float32 .npy matrix whose rows are partitioned
+        by tag, plus the key files needed by load_repr_by_memmap.
+    Param:
+        param1 [string] path to the repr file.
+        param2 [string] path prefix of the converted files.
+        param3 [list] of tags for identifying data whose repr should be kept.
+        param4 [int] number of header lines to skip. Default=0.
+    Return:
+        return1 [dict] where key=tag & val=number of converted repr.
+    Note:
+        1) Writes out_path + ".npy" (repr matrix), out_path + ".keys.npy" (row
+            keys) and out_path + ".json" (row range [start, end) of each tag).
+        2) A data point is assigned to the first tag in param3 it starts with;
+            data matching no tag is dropped.
+        3) The file is scanned twice so that rows are written straight into
+            the memory-mapped output without holding the text in memory.
+    """
+    def match_tag(tagged): # first tag prefixing the data, else None
+        for tag in tag_list:
+            if tagged[:len(tag)] == tag:
+                return tag
+        return None
+
+    print("Converting repr file:\t", path)
+
+    # Step 1: Collect the keys of each tag and the repr dimension.
+    tk_dict = {tag:[] for tag in tag_list}
+    dim = 0
+    with open(path) as f:
+        for line in islice(f, header, None):
+            tagged = line.split(" ", 1)[0]
+            tag = match_tag(tagged)
+            if tag is not None:
+                tk_dict[tag].append(tagged)
+                if dim == 0:
+                    dim = len(line.strip().split(" ")) - 1
+
+    # Step 2: Assign a contiguous row range to each tag.
+    range_dict = {}
+    row_dict = {} # key=tagged data & val=row in the repr matrix
+    start = 0
+    for tag in tag_list:
+        end = start + len(tk_dict[tag])
+        range_dict[tag] = [start, end]
+        row_dict.update(zip(tk_dict[tag], range(start, end)))
+        start = end
+    keys = [k for tag in tag_list for k in tk_dict[tag]]
+    del tk_dict
+
+    # Step 3: Parse the repr vectors into the memory-mapped matrix.
+    repr_matrix = np.lib.format.open_memmap(out_path + ".npy", mode='w+',
+            dtype=np.float32, shape=(len(keys), dim))
+    with open(path) as f:
+        for line in islice(f, header, None):
+            entry = line.strip().split(" ")
+            if entry[0] in row_dict:
+                repr_matrix[row_dict[entry[0]]] = entry[1:]
+    repr_matrix.flush()
+    del repr_matrix
+
+    # Step 4: Save the row keys and the tag partition.
+    np.save(out_path + ".keys.npy", np.array(keys))
+    with open(out_path + ".json", 'w') as f:
+        json.dump(range_dict, f, indent=4, sort_keys=True)
+
+    count_dict = {tag:end-start for tag, (start, end) in range_dict.items()}
+    print("Number of converted repr:\t", count_dict, end='\n\n')
+
+    return count_dict
+
+
+def load_repr_by_memmap(path, tag):
+    """ Load a tagged_data-representation IndexedMatrix from the files written
+        by convert_repr_to_npy without parsing or copying the repr.
+    Param:
+        param1 [string] path prefix of the converted files.
+        param2 [string] tag for identifying data whose repr should be loaded.
+    Return:
+        return1 [IndexedMatrix] whose repr_matrix is backed by a read-only
+                np.memmap.
+    Note:
+        1) param2 must be one of the tags given to convert_repr_to_npy.
+        2) Pages of the repr matrix are loaded on demand and shared by all
+            processes mapping the same file.
+    """
+    from ice_lib.retrieve import IndexedMatrix # deferred, as retrieve needs sklearn
+
+    print("Loading repr memmap:\t", path)
+    with open(path + ".json") as f:
+        start, end = json.load(f)[tag]
+
+    keys = np.load(path + ".keys.npy", mmap_mode='r')[start:end]
+    repr_matrix = np.load(path + ".npy", mmap_mode='r')[start:end]
+
+    print("Number of " + tag + "-repr:\t", end-start, end='\n\n')
+
+    return IndexedMatrix(keys, repr_matrix)
+
+
+@cache_parse
+def load_repr_matrices(path, tag_list, header=0):
+    """ Load the repr of several tags in a single scan of a repr file.
+    Param:
+        param1 [string] path to the repr file.
+        param2 [list] of tags for identifying data whose repr should be loaded.
+        param3 [int] number of header lines to skip. Default=0.
+    Return:
+        return1 [dict] where key=tag & val=IndexedMatrix of the tagged data.
+    Note:
+        1) Equivalent to calling load_repr_by_tag once per tag followed by
+            generate_indexed_matrix, without re-reading the file or keeping
+            repr as strings.
+        2) IndexedMatrix supports `in` and `[]` by item, so return1 vals can be
+            used wherever a repr dict is expected.
+    """
+    from ice_lib.retrieve import IndexedMatrix # deferred, as retrieve needs sklearn
+
+    tk_dict = {tag:[] for tag in tag_list} # key=tag & val=list of data
+    tr_dict = {tag:[] for tag in tag_list} # key=tag & val=list of repr rows
+    dim = 0
+
+    print("Loading repr file:\t", path)
+    with open(path) as f:
+        for line in islice(f, header, None):
+            entry = line.strip().split(" ")
+            tagged = entry[0]
+            for tag in tag_list: # route the row to every matching tag
+                if tagged[:len(tag)] == tag:
+                    row = np.array(entry[1:], dtype=np.float32)
+                    dim = len(row)
+                    tk_dict[tag].append(tagged)
+                    tr_dict[tag].append(row)
+
+    im_dict = {} # return1
+    for tag in tag_list:
+        repr_matrix = np.array(tr_dict[tag], dtype=np.float32).reshape(len(tk_dict[tag]), dim)
+        tr_dict[tag] = None # release rows early
+        im_dict[tag] = IndexedMatrix(tk_dict[tag], repr_matrix)
+        print("Number of " + tag + "-repr:\t", len(tk_dict[tag]))
+    print()
+
+    return im_dict
+
+
+@cache_parse
+def load_csr_by_tag(path, tag, directed, vocab=None):
+    """ Load and return a tagged_node-associated_node CSRGraph.
+    Param:
+        param1 [string] path to the edge list file.
+        param2 [string] tag for identifying nodes used as keys.
+        param3 [bool] whether one-direction or two-way loadng.
+        param4 [Vocabulary] shared node vocabulary to extend. Default=None,
+                i.e. a new vocabulary.
+    Return:
+        return1 [CSRGraph] whose dict-like view equals the dict returned by
+                load_el_by_tag.
+    Note:
+        1) Duplicated edges are dropped; rows and assoc nodes keep the order
+            in which they first appear in the file.
+    """
+    if vocab is None:
+        vocab = Vocabulary()
+    src_ids = array('i') # tagged node of each edge
+    dst_ids = array('i') # assoc node of each edge
+
+    print("Loading edge list:\t",path)
+    with open(path) as f:
+        for edge in f:
+            entry = edge.strip().split(" ")
+            left = vocab.add(entry[0])
+            right = vocab.add(entry[1])
+
+    # Step 1: Check the left node.
+            if entry[0][:len(tag)] == tag:
+                src_ids.append(left)
+                dst_ids.append(right)
+
+    # Step 2: Check the right node.
+            if not directed and entry[1][:len(tag)] == tag:
+                src_ids.append(right)
+                dst_ids.append(left)
+
+    # Step 3: Drop duplicated edges while keeping the file order.
+    src_ids = np.frombuffer(src_ids, dtype=np.int32)
+    dst_ids = np.frombuffer(dst_ids, dtype=np.int32)
+    edge_keys = src_ids.astype(np.int64)*len(vocab) + dst_ids
+    _, first_edges = np.unique(edge_keys, return_index=True)
+    first_edges.sort()
+    src_ids, dst_ids = src_ids[first_edges], dst_ids[first_edges]
+
+    # Step 4: Number rows by the first appearance of each tagged node.
+    keys, first_srcs = np.unique(src_ids, return_index=True)
+    keys = keys[np.argsort(first_srcs)]
+    row_idx = np.empty(len(vocab), dtype=np.int64)
+    row_idx[keys] = np.arange(len(keys))
+    rows = row_idx[src_ids]
+
+    # Step 5: Group assoc nodes by row.
+    neighbors = dst_ids[np.argsort(rows, kind='stable')]
+    offsets = np.zeros(len(keys)+1, dtype=np.int32)
+    offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(keys)))
+
+    print("Number of "+ tag + "-nodes:\t", len(keys), end='\n\n')
+
+    return CSRGraph(vocab, keys, offsets, neighbors)
+
+
+def convert_lyric_to_corpus(path, out_path, tag):
+    """ Convert a song-lyric JSON file to the corpus files read by
+        LyricCorpus.
+    Param:
+        param1 [string] path to song-lyric JSON file.
+        param2 [string] path prefix of the corpus files.
+        param3 [string] tag for prefixing to song ID.
+    Return:
+        return1 [int] number of converted lyrics.
+    Note:
+        1) Writes out_path + ".bin" (concatenated UTF-8 lyrics), out_path +
+            ".idx.npy" (byte offsets) and out_path + ".keys.npy" (sorted
+            songs).
+    """
+    lyric_dict = load_lyric_dict(path, tag)
+    songs = sorted(lyric_dict.keys())
+    offsets = np.zeros(len(songs)+1, dtype=np.int64)
+
+    print("Converting lyric dict:\t", path)
+    with open(out_path + ".bin", 'wb') as f:
+        for idx, song in enumerate(songs):
+            lyric = lyric_dict[song].encode('utf-8')
+            f.write(lyric)
+            offsets[idx+1] = offsets[idx] + len(lyric)
+
+    np.save(out_path + ".idx.npy", offsets)
+    np.save(out_path + ".keys.npy", np.array(songs))
+    print("Number of converted lyrics:\t", len(songs), end='\n\n')
+
+    return len(songs)
+
+
+def load_lyric_corpus(path):
+    """ Load a song-lyric LyricCorpus without parsing any lyric.
+    Param:
+        param1 [string] path prefix of the corpus files.
+    Return:
+        return1 [LyricCorpus] which can replace the dict returned by
+                load_lyric_dict.
+    """
+    print("Loading lyric corpus:\t", path)
+    lyric_corpus = LyricCorpus(path)
+    print("Number of lyrics:\t", len(lyric_corpus), end='\n\n')
+
+    return lyric_corpus
+
+
+def load_song_metadata_store(path, tag, index_path=None):
+    """ Load a song-metadata SongMetadataStore which indexes line offsets
+        instead of parsing metadata.
+    Param:
+        param1 [string] path to load the song-metadata file.
+        param2 [string] tag for prefixing to song ID.
+        param3 [string] path to the .npz offset index, which is reused if it is
+                newer than param1 and rebuilt otherwise. Default=None, i.e.
+                always index.
+    Return:
+        return1 [SongMetadataStore] which can replace the dict returned by
+                load_song_metadata_dict.
+    """
+    print("Loading metadata store:\t", path)
+
+    # Step 1: Reuse an up-to-date offset index.
+    if index_path is not None and os.path.exists(index_path) \
+            and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with np.load(index_path) as data:
+            songs, offsets = data['songs'], data['offsets']
+
+    # Step 2: Record the offset of each song's line, the last line winning.
+    else:
+        so_dict = {} # key=song & val=line byte offset
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                so_dict[tag + line.split(b'\t', 1)[0].decode('utf-8')] = offset
+                offset += len(line)
+
+        songs = np.array(sorted(so_dict.keys()))
+        offsets = np.array([so_dict[song] for song in songs.tolist()], dtype=np.int64)
+        if index_path is not None:
+            np.savez(index_path, songs=songs, offsets=offsets)
+
+    print("Number of metadata:\t", len(songs), end='\n\n')
+    return SongMetadataStore(path, tag, songs, offsets)
+
+
+def generate_relation_matrix(item_dict, row_vocab, col_vocab):
+    """ Convert an item-items dictionary to a boolean CSR relation matrix.
+    Param:
+        param1 [dict] where key=row item & val=list of column items.
+        param2 [Vocabulary] of row items to extend.
+        param3 [Vocabulary] of column items to extend.
+    Return:
+        return1 [sparse.csr_matrix] of int32 ones with one row per param2 id
+                and one column per param3 id at the time of the call.
+    """
+    rows = array('i')
+    cols = array('i')
+    for item, assoc_list in item_dict.items():
+        rows.extend([row_vocab.add(item)]*len(assoc_list))
+        cols.extend(col_vocab.encode(assoc_list))
+
+    relation_mat = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(row_vocab), len(col_vocab)))
+    relation_mat.data[:] = 1 # collapse duplicated relations
+
+    return relation_mat
+
+
+def join_relation_matrix(item12_dict, item23_dict):
+    """ Join an item1-item2 relation to an item2-item3 relation by a sparse
+        matrix product.
+    Param:
+        param1 [dict] where key=item1 & val=list of item2
+        param2 [dict] where key=item2 & val=list of itme3
+    Return:
+        return1 [sparse.csr_matrix] of item1-item3 path counts.
+        return2 [Vocabulary] of item1 indexing return1 rows.
+        return3 [Vocabulary] of item3 indexing return1 columns.
+        return4 [ndarray] of bool s.t. True marks item1 having an item2 in
+                param2, i.e. the keys of join_dictionary's result.
+    """
+    item1_vocab, item2_vocab, item3_vocab = Vocabulary(()), Vocabulary(()), Vocabulary(())
+
+    # Step 1: Build both relations over a shared item2 vocabulary.
+    item12_mat = generate_relation_matrix(item12_dict, item1_vocab, item2_vocab)
+    item23_mat = generate_relation_matrix(item23_dict, item2_vocab, item3_vocab)
+    item12_mat.resize((len(item1_vocab), len(item2_vocab)))
+    item23_mat.resize((len(item2_vocab), len(item3_vocab)))
+
+    # Step 2: Count item1-item3 paths through item2.
+    item13_mat = (item12_mat @ item23_mat).tocsr()
+    item13_mat.sort_indices()
+
+    # Step 3: Mark item1 which reach any item2 in param2.
+    has_item3 = np.zeros(len(item2_vocab), dtype=np.int32)
+    has_item3[item2_vocab.encode(item23_dict.keys())] = 1
+    joinable = item12_mat @ has_item3 > 0
+
+    return item13_mat, item1_vocab, item3_vocab, joinable
+
+
+@cache_parse
+def load_song_tfidf_matrix(path, tag):
+    """ Load and return a song-word TfidfMatrix.
+    Param:
+        param1 [string] path to load the JSON file of a list of dict storing
+                song id, tfidf-picked lyric keywords, and tfidf scores.
+        param2 [string] tag for prefixing to song ID.
+    Return:
+        return1 [TfidfMatrix] whose dict-like view equals the dict returned by
+                load_song_tfidf_dict.
+    """
+    songs = []
+    word_idx = {} # key=word & val=column
+    indices = array('i')
+    data = array('d')
+    indptr = array('q', [0])
+
+    with open(path) as f:
+        for iks_dict in json.load(f):
+            songs.append(tag + str(iks_dict['id']))
+            indices.extend([word_idx.setdefault('w' + k, len(word_idx)) for k in iks_dict['keywords']])
+            data.extend(iks_dict['scores'])
+            indptr.append(len(indices))
+
+    score_mat = sparse.csr_matrix((np.frombuffer(data, dtype=np.float64),
+            np.frombuffer(indices, dtype=np.int32), np.frombuffer(indptr, dtype=np.int64)),
+            shape=(len(songs), len(word_idx)))
+
+    return TfidfMatrix(songs, list(word_idx.keys()), score_mat)
+
+
+def filter_song_tfidf_matrix(tfidf_mat, sl_dict):
+    """ Filter out lyric words that do NOT exist in the current song-lyric graph
+        from a TfidfMatrix by a column mask.
+    Param:
+        param1 [TfidfMatrix] of song-word tfidf scores.
+        param2 [dict|CSRGraph] where key=song & val=list of lyric keywords.
+    Return:
+        return1 [TfidfMatrix] as filter_song_tfidf_dict filters its dict.
+    """
+    # Step 1: Collect valid lyric words from the current song-lyric graph.
+    if isinstance(sl_dict, CSRGraph):
+        valid_words = set(sl_dict.vocab.decode(np.unique(sl_dict.neighbors)))
+    else:
+        valid_words = set()
+        for song in sl_dict:
+            valid_words |= set(sl_dict[song])
+
+    # Step 2: Mask the columns of invalid words.
+    word_mask = np.array([word in valid_words for word in tfidf_mat.words], dtype=bool)
+
+    return tfidf_mat.filter_words(word_mask)
+
+
+def load_resources(spec_list, worker_num=None, use_process=True, prefetch_num=None):
+    """ Load resources concurrently and yield each as soon as it completes.
+    Param:
+        param1 [list] of 3-tuple of resource name, loader function, and tuple
+                of loader arguments, e.g. ("syn", load_csr_by_tag, (path, 'w',
+                True)).
+        param2 [int] number of workers. Default=None, i.e. the executor's.
+        param3 [bool] parse in a process pool, otherwise a thread pool.
+                Default=True, i.e. CPU-bound parsing runs on separate cores.
+        param4 [int] number of resources loaded ahead of the one being
+                consumed. Default=None, i.e. all at once.
+    Return:
+        return1 [generator] of 2-tuple of resource name and loaded resource,
+                in completion order.
+    Note:
+        1) Loaders must be module-level functions for a process pool, and
+           their returns are pickled back; LyricCorpus & SongMetadataStore
+           re-map their files instead of copying them.
+        2) Process workers share only the disk layer of parse_cache, while
+           thread workers also fill its in-process LRU if one is enabled.
+        3) A process pool needs the caller's script guarded by
+           if __name__ == "__main__" under the spawn & forkserver methods.
+        4) Set param4 to bound the number of resident resources, e.g. large
+           repr matrices consumed one at a time.
+    """
+    if use_process:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=worker_num)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_num)
+
+    with executor:
+        spec_iter = iter(spec_list)
+        future_dict = {} # key=pending future & val=resource name
+
+        def submit_specs(spec_num):
+            for name, loader, args in islice(spec_iter, spec_num):
+                future_dict[executor.submit(loader, *args)] = name
+
+        submit_specs(None if prefetch_num is None else max(prefetch_num, 1))
+        while future_dict:
+            done, _ = concurrent.futures.wait(future_dict, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = future_dict.pop(future)
+                submit_specs(1) # keep param4 loading while this one is consumed
+                yield (name, future.result())
+
+
+def calculate_graph_stats(sl_path, ll_path=None):
+    """ Calculate the structure stats of a song-lyric graph expanded by a
+        lyric-lyric graph with sparse set operations.
+    Param:
+        param1 [string] path to the song-lyric edge list.
+        param2 [string] path to the lyric-lyric edge list. Default=None, i.e.
+                stats of the song-lyric graph alone.
+    Return:
+        return1 [dict] where key=stat name & val=stat, i.e. song_num (|V|),
+                word_num (|T|), sl_edge_num (|E_et|), ll_edge_num (|E_tt|),
+                exp_edge_num (|Ē_et|), avg_deg (d̄), and deg_hist, the count of
+                nodes by degree.
+    Note:
+        1) |E_tt| counts a self reference per word, each directed edge, and a
+           reversed edge for each edge that is NOT reciprocated.
+        2) |Ē_et| counts song-word pairs reached via a keyword of the song,
+           where the word is NOT a keyword of the song.
+        3) Degrees count an edge at both ends s.t. they sum to 2*|E|.
+    """
+    stat_dict = dict() # return1
+
+    # Step 1: Build the adjacency over shared node ids.
+    vocab = Vocabulary()
+    sl_graph = load_csr_by_tag(sl_path, 's', True, vocab)
+    if ll_path is not None:
+        ll_graph = load_csr_by_tag(ll_path, 'w', True, vocab)
+    node_num = len(vocab)
+    sl_mat = sl_graph.get_adjacency(node_num)
+
+    song_deg = np.diff(sl_mat.indptr)
+    word_deg = np.bincount(sl_mat.indices, minlength=node_num)
+
+    stat_dict['song_num'] = len(sl_graph)
+    stat_dict['sl_edge_num'] = sl_mat.nnz
+
+    # Step 2: Count song-lyric stats alone.
+    if ll_path is None:
+        word_mask = word_deg > 0
+        stat_dict['word_num'] = int(word_mask.sum())
+        stat_dict['ll_edge_num'] = "-"
+        stat_dict['exp_edge_num'] = "-"
+        edge_num = stat_dict['sl_edge_num']
+
+    # Step 3: Count lyric-lyric & expansion stats.
+    else:
+        ll_mat = ll_graph.get_adjacency(node_num)
+        word_mask = np.zeros(node_num, dtype=bool) # keywords & related words
+        word_mask[ll_graph.key_ids] = True
+        word_mask[ll_graph.neighbors] = True
+        stat_dict['word_num'] = int(word_mask.sum())
+
+        recip_num = ll_mat.multiply(ll_mat.T).nnz
+        stat_dict['ll_edge_num'] = stat_dict['word_num'] + 2*ll_mat.nnz - recip_num
+
+        exp_mat = sl_mat @ ll_mat
+        exp_mat.data[:] = 1
+        exp_mat = (exp_mat - exp_mat.multiply(sl_mat)).tocsr()
+        exp_mat.eliminate_zeros()
+        stat_dict['exp_edge_num'] = exp_mat.nnz
+
+        sym_mat = ((ll_mat + ll_mat.T) > 0).tocsr()
+        sym_mat.setdiag(False)
+        sym_mat.eliminate_zeros()
+        song_deg = song_deg + np.diff(exp_mat.indptr)
+        word_deg = word_deg + np.bincount(exp_mat.indices, minlength=node_num)
+        word_deg = word_deg + 2*(np.diff(sym_mat.indptr) + ll_mat.diagonal() + word_mask)
+
+        edge_num = stat_dict['sl_edge_num'] + stat_dict['ll_edge_num'] + stat_dict['exp_edge_num']
+
+    # Step 4: Summarize degrees.
+    stat_dict['avg_deg'] = 2*edge_num/(stat_dict['song_num']+stat_dict['word_num'])
+    stat_dict['deg_hist'] = np.bincount(np.concatenate([song_deg[sl_graph.key_ids], word_deg[word_mask]]))
+
+    return stat_dict
+
+
+def calculate_all_graph_stats(sl_path_list, ll_path_list=None, worker_num=None):
+    """ Calculate the structure stats of several graph settings concurrently.
+    Param:
+        param1 [list] of paths to song-lyric edge lists.
+        param2 [list] of paths to lyric-lyric edge lists aligned with param1.
+                Default=None, i.e. stats of the song-lyric graphs alone.
+        param3 [int] number of workers. Default=None, i.e. the executor's.
+    Return:
+        return1 [list] of dicts returned by calculate_graph_stats, aligned
+                with param1.
+    """
+    if ll_path_list is None:
+        ll_path_list = [None]*len(sl_path_list)
+
+    spec_list = [(idx, calculate_graph_stats, (sl_path, ll_path))
+            for idx, (sl_path, ll_path) in enumerate(zip(sl_path_list, ll_path_list))]
+    stat_dict = dict(load_resources(spec_list, worker_num))
+
+    return [stat_dict[idx] for idx in range(len(sl_path_list))]
+
+
+def build_expanded_graph(sl_path, ll_path, out_path, exp_tag=None, weighted=False,
+        with_sl=True, chunk_size=65536):
+    """ Build the song-lyric graph expanded by a lyric-lyric graph and write it
+        as an edge list, a chunk of songs at a time.
+    Param:
+        param1 [string] path to the song-lyric edge list.
+        param2 [string] path to the lyric-lyric edge list.
+        param3 [string] path to write the expanded edge list.
+        param4 [string] tag replacing 'w' of expansion words, e.g. "exp_w".
+                Default=None, i.e. expansion words keep the 'w' tag.
+        param5 [bool] whether to write weights as the 3rd column, i.e. 1 for
+                a keyword & the number of keywords reaching an expansion word.
+                Default=False.
+        param6 [bool] whether to write the song-keyword edges as well.
+                Default=True.
+        param7 [int] number of songs expanded per chunk. Default=65536.
+    Return:
+        return1 [dict] where key=stat name & val=number of edges, i.e.
+                sl_edge_num (|E_et|) & exp_edge_num (|Ē_et|) as counted by
+                calculate_graph_stats.
+    Note:
+        1) An expansion word is an LL neighbor of a song's keyword that is NOT
+           a keyword of the song, as in table_3.py.
+        2) Memory of the expansion grows with param7, NOT the number of songs.
+    """
+    edge_dict = {'sl_edge_num':0, 'exp_edge_num':0} # return1
+
+    # Step 1: Build the song-keyword & keyword-word adjacency.
+    vocab = Vocabulary()
+    sl_graph = load_csr_by_tag(sl_path, 's', True, vocab)
+    ll_graph = load_csr_by_tag(ll_path, 'w', True, vocab)
+    node_num = len(vocab)
+    sl_mat = sparse.csr_matrix((np.ones(len(sl_graph.neighbors), dtype=np.int32),
+            sl_graph.neighbors, sl_graph.offsets), shape=(len(sl_graph), node_num))
+    ll_mat = ll_graph.get_adjacency(node_num)
+
+    # Step 2: Map expansion words to their written names.
+    exp_ids = np.arange(node_num, dtype=np.int32)
+    if exp_tag is not None:
+        for idx in np.unique(ll_graph.neighbors).tolist():
+            vocab.add_tagged(exp_tag, vocab.get_name(idx))
+        exp_ids = vocab.translate(exp_ids, 'w', exp_tag)
+        exp_ids = np.where(exp_ids >= 0, exp_ids, np.arange(node_num))
+    songs = vocab.decode(sl_graph.key_ids)
+
+    # Step 3: Expand & write songs chunk by chunk.
+    with open(out_path, 'w') as f:
+        for start in range(0, len(songs), chunk_size):
+            sl_chunk = sl_mat[start:start+chunk_size]
+            exp_chunk = sl_chunk @ ll_mat
+            exp_chunk = (exp_chunk - exp_chunk.multiply(sl_chunk > 0)).tocsr()
+            exp_chunk.eliminate_zeros()
+
+            lines = []
+            for row in range(sl_chunk.shape[0]):
+                song = songs[start+row]
+                edge_list = []
+                if with_sl:
+                    s_start, s_end = sl_chunk.indptr[row], sl_chunk.indptr[row+1]
+                    edge_list += [(vocab.tokens[idx], 1) for idx in sl_chunk.indices[s_start:s_end]]
+                e_start, e_end = exp_chunk.indptr[row], exp_chunk.indptr[row+1]
+                edge_list += [(vocab.tokens[exp_ids[idx]], weight) for idx, weight in
+                        zip(exp_chunk.indices[e_start:e_end], exp_chunk.data[e_start:e_end].tolist())]
+
+                if weighted:
+                    lines += [song + " " + node + " " + str(weight) + "\n" for node, weight in edge_list]
+                else:
+                    lines += [song + " " + node + "\n" for node, _ in edge_list]
+            f.writelines(lines)
+
+            edge_dict['sl_edge_num'] += sl_chunk.nnz
+            edge_dict['exp_edge_num'] += exp_chunk.nnz
+
+    return edge_dict
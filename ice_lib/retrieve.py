@@ -19,14 +19,22 @@
 # Date: 03/15/2016
 # Cont:
 #	Clas:
-#		1) IndexedMatrix
+#		1) IndexedMatrix                    2) IVFIndex
+#		3) KeywordIndex                     4) PopularityRanker
+#		5) QuantizedIndexedMatrix
 #	Func:
 #       1) retrieve_by_random               2) retrieve_by_popularity
 #		3) retrieve_by_keyword              4) retrieve_by_repr
-#		5) generate_indexed_matrix          6) calculate_repr_distance
+#		5) retrieve_batch                   6) generate_indexed_matrix
+#		7) calculate_repr_distance          8) generate_ivf_index
+#		9) load_ivf_index                   10) calculate_centroid_distance
+#		11) generate_keyword_index          12) load_keyword_index
+#		13) generate_degree_ranker          14) quantize_indexed_matrix
 
 
+import heapq
 import numpy as np
+from array import array
 from random import shuffle
 from collections import Counter
 from sklearn.metrics import pairwise_distances
@@ -42,10 +50,518 @@ class IndexedMatrix():
         Param:
             param0 [self] reference to this object.
             param1 [list] of items.
-            param2 [list] of lists of item-associated repr.
+            param2 [list] of lists of item-associated repr, or an [ndarray]
+                    such as a np.memmap which is used without copying.
         """
-        self.items = np.array(items)
-        self.repr_matrix = np.array(repr_matrix).astype(np.float32)
+        self.items = np.asarray(items)
+        self.repr_matrix = np.asarray(repr_matrix, dtype=np.float32)
+        self.item_idx = None # lazily built item-row look-up table
+        self.row_norms = None # lazily computed L2 norm of each row
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.get_item_index()
+
+    def __getitem__(self, item):
+        """ Dict-like access to an item's repr so that an IndexedMatrix can
+            replace a repr dict, e.g. in retrieve_by_repr.
+        """
+        return self.repr_matrix[self.get_item_index()[item]]
+
+    def get_item_index(self):
+        """ Build once and return the item-row look-up table.
+        Param:
+            param0 [self] reference to this object.
+        Return:
+            return1 [dict] where key=item & val=row index in repr_matrix.
+        """
+        if self.item_idx is None:
+            self.item_idx = {item:idx for idx, item in enumerate(self.items.tolist())}
+        return self.item_idx
+
+    def get_row_norms(self, block_size=65536):
+        """ Compute once and return the L2 norm of each repr row.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] number of rows normalized at a time. Default=65536.
+        Return:
+            return1 [ndarray] of float32 row norms where zero norms are set to
+                    1 so that zero vectors keep a cosine similarity of 0.
+        """
+        if self.row_norms is None:
+            row_norms = np.empty(len(self.repr_matrix), dtype=np.float32)
+            for start in range(0, len(self.repr_matrix), block_size):
+                block = self.repr_matrix[start:start+block_size]
+                row_norms[start:start+len(block)] = np.linalg.norm(block, axis=1)
+            row_norms[row_norms == 0] = 1
+            self.row_norms = row_norms
+        return self.row_norms
+
+    def prepare_queries(self, query_matrix, metric):
+        """ Convert queries to float32 and unit-normalize them for cosine.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of query repr, one query per row.
+            param2 [string] distance metric.
+        Return:
+            return1 [ndarray] of queries ready for calculate_block_distance.
+        """
+        query_matrix = np.asarray(query_matrix, dtype=np.float32)
+        if metric == "cosine":
+            query_norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+            query_norms[query_norms == 0] = 1
+            query_matrix = query_matrix / query_norms
+        return query_matrix
+
+    def calculate_block_distance(self, query_matrix, rows, metric):
+        """ Calculate the distance between queries and a block of rows.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of queries returned by prepare_queries.
+            param2 [slice|ndarray] of rows in the block.
+            param3 [string] distance metric.
+        Return:
+            return1 [ndarray] of float32 distances b/t every query and row.
+        """
+        block = self.repr_matrix[rows]
+        if metric == "cosine":
+            return 1 - np.dot(query_matrix, block.T) / self.get_row_norms()[rows]
+        elif metric == "dot_product":
+            return -np.dot(query_matrix, block.T)
+        else:
+            return pairwise_distances(query_matrix, block, metric).astype(np.float32)
+
+    def top_k(self, query_matrix, k, metric="cosine", block_size=65536, cell_budget=1<<22):
+        """ Find the k rows closest to each query by scoring the matrix block by
+            block and keeping only the running k best rows per query.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of query repr, one query per row.
+            param2 [int] number of rows to find per query.
+            param3 [string] distance metric, "cosine", "dot_product" or any
+                    metric from sklearn.metrics. Default="cosine".
+            param4 [int] number of rows scored at a time. Default=65536.
+            param5 [int] max number of query-row distances held at a time;
+                    queries are scored in chunks of param5//(param2+param4).
+                    Default=1<<22.
+        Return:
+            return1 [ndarray] of row indices ordered ascendingly by distance,
+                    one row per query.
+            return2 [ndarray] of distances aligned with return1.
+        Note:
+            1) Distances agree with calculate_repr_distance.
+            2) Scratch memory is O(param5) per block, i.e. independent of the
+                number of rows, and the results are O(queries * param2).
+            3) Ties are broken by row index.
+        """
+        k = max(0, min(k, len(self))) # handle neg & oversized k
+        idx_dtype = np.int32 if len(self) < 2**31 else np.int64
+
+        # Step 1: Unit-normalize queries so that cosine becomes a dot product.
+        query_matrix = self.prepare_queries(query_matrix, metric)
+        query_num = len(query_matrix)
+        query_step = max(1, cell_budget // (k+block_size))
+
+        best_idx = np.empty((query_num, k), dtype=idx_dtype)
+        best_dist = np.empty((query_num, k), dtype=np.float32)
+        for q_start in range(0, query_num if k > 0 else 0, query_step):
+            q_end = min(q_start+query_step, query_num)
+            chunk_idx = np.empty((q_end-q_start, 0), dtype=idx_dtype)
+            chunk_dist = np.empty((q_end-q_start, 0), dtype=np.float32)
+
+        # Step 2: Keep the k closest rows seen so far block by block.
+            for start in range(0, len(self), block_size):
+                end = min(start+block_size, len(self))
+                block_dist = self.calculate_block_distance(query_matrix[q_start:q_end], slice(start, end), metric)
+
+                kept = chunk_dist.shape[1] # candidates [0, kept) are kept rows
+                cand_dist = np.hstack([chunk_dist, block_dist])
+                if cand_dist.shape[1] > k:
+                    part = np.argpartition(cand_dist, k-1, axis=1)[:, :k]
+                else:
+                    part = np.broadcast_to(np.arange(cand_dist.shape[1]), cand_dist.shape)
+                chunk_dist = np.take_along_axis(cand_dist, part, axis=1)
+                cand_idx = (part + (start-kept)).astype(idx_dtype) # block-local offset to row
+                if kept > 0:
+                    is_kept = part < kept
+                    cand_idx[is_kept] = np.take_along_axis(chunk_idx, np.where(is_kept, part, 0), axis=1)[is_kept]
+                chunk_idx = cand_idx
+
+            best_idx[q_start:q_end], best_dist[q_start:q_end] = chunk_idx, chunk_dist
+
+        # Step 3: Sort only the k winners of each query.
+        order = np.lexsort((best_idx, best_dist), axis=-1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        best_dist = np.take_along_axis(best_dist, order, axis=1)
+
+        return best_idx, best_dist
+
+
+class QuantizedIndexedMatrix(IndexedMatrix):
+    """
+    IndexedMatrix which keeps a float16 or int8 copy of its repr for a fast
+    approximate scoring pass and re-scores a shortlist exactly in float32.
+    """
+
+    def __init__(self, items, repr_matrix, mode="int8", rescore_factor=4, block_size=65536, keep_repr=True):
+        """ Constructor for QuantizedIndexedMatrix.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of items.
+            param2 [ndarray] of item-associated repr, ideally a np.memmap from
+                    load_repr_by_memmap so that only param3 codes stay in RAM.
+            param3 [string] quantization mode, "float16" or "int8" with one
+                    scale per row. Default="int8".
+            param4 [int] shortlist size as a multiple of k for exact
+                    re-scoring. Default=4.
+            param5 [int] number of rows quantized at a time. Default=65536.
+            param6 [bool] whether to keep param2 for exact re-scoring.
+                    Default=True.
+        Note:
+            1) Keeping an in-memory param2 adds the codes on top of it, i.e.
+                RAM grows rather than shrinks; pass a np.memmap for param2 or
+                set param6=False to hold only the codes in RAM.
+            2) Without param2, top_k returns the approximate ranking of the
+                codes and the matrix cannot back an IVFIndex.
+        """
+        IndexedMatrix.__init__(self, items, repr_matrix)
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+
+        if mode == "float16":
+            self.codes = np.empty(self.repr_matrix.shape, dtype=np.float16)
+        elif mode == "int8":
+            self.codes = np.empty(self.repr_matrix.shape, dtype=np.int8)
+        else:
+            raise ValueError("Unknown quantization mode: '" + mode + "'")
+        self.scales = np.ones(len(self.repr_matrix), dtype=np.float32)
+
+        # Step 1: Quantize rows block by block.
+        for start in range(0, len(self.repr_matrix), block_size):
+            end = min(start+block_size, len(self.repr_matrix))
+            block = np.asarray(self.repr_matrix[start:end])
+            if mode == "int8":
+                scales = np.abs(block).max(axis=1) / 127
+                scales[scales == 0] = 1
+                self.scales[start:end] = scales
+                block = np.rint(block / self.scales[start:end, None])
+            self.codes[start:end] = block
+
+        # Step 2: Compute exact row norms once for cosine re-scoring.
+        self.get_row_norms(block_size)
+        if not keep_repr:
+            self.repr_matrix = None # release the float32 copy
+
+    def __getitem__(self, item):
+        """ Dict-like access to an item's repr, decoded from the codes if the
+            float32 repr was released.
+        """
+        if self.repr_matrix is not None:
+            return IndexedMatrix.__getitem__(self, item)
+        row = self.get_item_index()[item]
+        return self.codes[row].astype(np.float32) * self.scales[row]
+
+    def calculate_block_distance(self, query_matrix, rows, metric):
+        """ Approximately calculate the distance between queries and a block of
+            rows from the quantized codes.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of queries returned by prepare_queries.
+            param2 [slice|ndarray] of rows in the block.
+            param3 [string] distance metric.
+        Return:
+            return1 [ndarray] of float32 distances b/t every query and row.
+        """
+        block = self.codes[rows].astype(np.float32)
+        if metric == "cosine":
+            return 1 - np.dot(query_matrix, block.T) * (self.scales[rows] / self.get_row_norms()[rows])
+        elif metric == "dot_product":
+            return -np.dot(query_matrix, block.T) * self.scales[rows]
+        else:
+            block *= self.scales[rows][:, None]
+            return pairwise_distances(query_matrix, block, metric).astype(np.float32)
+
+    def top_k(self, query_matrix, k, metric="cosine", block_size=65536, cell_budget=1<<22):
+        """ Find the k rows closest to each query by shortlisting rows with the
+            quantized codes and then re-scoring the shortlist exactly.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of query repr, one query per row.
+            param2 [int] number of rows to find per query.
+            param3 [string] distance metric. Default="cosine".
+            param4 [int] number of rows scored at a time. Default=65536.
+            param5 [int] max number of query-row distances held at a time,
+                    see IndexedMatrix.top_k. Default=1<<22.
+        Return:
+            return1 [ndarray] of row indices ordered ascendingly by exact
+                    distance, one row per query.
+            return2 [ndarray] of exact distances aligned with return1.
+        Note:
+            1) Without the float32 repr, the approximate top-k is returned.
+        """
+        k = max(0, min(k, len(self))) # handle neg & oversized k
+        if self.repr_matrix is None:
+            return IndexedMatrix.top_k(self, query_matrix, k, metric, block_size, cell_budget)
+
+        # Step 1: Shortlist rows with the approximate distances.
+        short_idx, _ = IndexedMatrix.top_k(self, query_matrix, self.rescore_factor*k, metric, block_size, cell_budget)
+
+        # Step 2: Re-score each query's shortlist exactly in float32.
+        query_matrix = self.prepare_queries(query_matrix, metric)
+        best_idx = np.empty((len(query_matrix), k), dtype=np.int64)
+        best_dist = np.empty((len(query_matrix), k), dtype=np.float32)
+        for q_idx in range(len(query_matrix) if k > 0 else 0):
+            rows = np.sort(short_idx[q_idx]) # sequential access for memmap
+            dist = IndexedMatrix.calculate_block_distance(self, query_matrix[q_idx:q_idx+1], rows, metric)[0]
+            order = np.lexsort((rows, dist))[:k]
+            best_idx[q_idx] = rows[order]
+            best_dist[q_idx] = dist[order]
+
+        return best_idx, best_dist
+
+
+class IVFIndex():
+    """
+    Inverted-file index which clusters the rows of an IndexedMatrix for
+    approximate nearest neighbour search.
+    """
+
+    def __init__(self, rec_mat, centroids, offsets, rows, metric="cosine", probe_num=8):
+        """ Constructor for IVFIndex.
+        Param:
+            param0 [self] reference to this object.
+            param1 [IndexedMatrix] of indexed items.
+            param2 [ndarray] of centroids, one per inverted list.
+            param3 [ndarray] of offsets s.t. inverted list i holds
+                    param4[param3[i]:param3[i+1]].
+            param4 [ndarray] of param1 row indices grouped by inverted list.
+            param5 [string] distance metric the index is built for.
+                    Default="cosine".
+            param6 [int] default number of inverted lists probed per query.
+                    Default=8.
+        """
+        if rec_mat.repr_matrix is None:
+            raise ValueError("IVFIndex needs the float32 repr of its items")
+        self.rec_mat = rec_mat
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets)
+        self.rows = np.asarray(rows)
+        self.metric = metric
+        self.probe_num = probe_num
+
+    def search(self, query_matrix, k, metric="cosine", probe_num=None):
+        """ Approximately find the k rows closest to each query by exactly
+            scoring only the rows in the inverted lists closest to the query.
+        Param:
+            param0 [self] reference to this object.
+            param1 [ndarray] of query repr, one query per row.
+            param2 [int] number of rows to find per query.
+            param3 [string] distance metric, which must be the one the index is
+                    built for. Default="cosine".
+            param4 [int] number of inverted lists to probe per query; larger
+                    values trade latency for recall. Default=self.probe_num.
+        Return:
+            return1 [ndarray] of row indices ordered ascendingly by distance,
+                    one row per query.
+            return2 [ndarray] of distances aligned with return1.
+        Note:
+            1) Same return format as IndexedMatrix.top_k.
+            2) More lists than param4 are probed if they hold < param2 rows.
+        """
+        if metric != self.metric:
+            raise ValueError("IVFIndex built for '" + self.metric + "' cannot search by '" + metric + "'")
+        if probe_num is None:
+            probe_num = self.probe_num
+        k = max(0, min(k, len(self.rows))) # handle neg & oversized k
+
+        query_matrix = self.rec_mat.prepare_queries(query_matrix, metric)
+        best_idx = np.empty((len(query_matrix), k), dtype=np.int64)
+        best_dist = np.empty((len(query_matrix), k), dtype=np.float32)
+        if k == 0:
+            return best_idx, best_dist
+
+        # Step 1: Order the inverted lists by closeness to each query.
+        list_mat = calculate_centroid_distance(query_matrix, self.centroids, metric).argsort(axis=1)
+        list_sizes = np.diff(self.offsets)
+
+        for q_idx, list_order in enumerate(list_mat):
+        # Step 2: Probe the closest lists until there are at least k rows.
+            list_num = max(probe_num, np.searchsorted(np.cumsum(list_sizes[list_order]), k) + 1)
+            cand_rows = np.sort(np.concatenate([self.rows[self.offsets[l]:self.offsets[l+1]] for l in list_order[:list_num]]))
+
+        # Step 3: Exactly score the probed rows and keep the k closest.
+            cand_dist = IndexedMatrix.calculate_block_distance(self.rec_mat, query_matrix[q_idx:q_idx+1], cand_rows, metric)[0]
+            if len(cand_rows) > k:
+                part = np.argpartition(cand_dist, k-1)[:k]
+                cand_rows, cand_dist = cand_rows[part], cand_dist[part]
+            order = np.lexsort((cand_rows, cand_dist))
+            best_idx[q_idx] = cand_rows[order]
+            best_dist[q_idx] = cand_dist[order]
+
+        return best_idx, best_dist
+
+    def save(self, path):
+        """ Save the index, without the indexed IndexedMatrix, as a .npz file.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] path to save the index.
+        """
+        np.savez(path, centroids=self.centroids, offsets=self.offsets,
+                rows=self.rows, metric=self.metric, probe_num=self.probe_num)
+
+
+class KeywordIndex():
+    """
+    Character-bigram inverted index over unsegmented textual content for
+    finding and counting keyword occurrences without scanning every item.
+    """
+
+    def __init__(self, items, grams, offsets, postings, content_dict):
+        """ Constructor for KeywordIndex.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of indexed items.
+            param2 [list] of character bigrams.
+            param3 [ndarray] of offsets s.t. the posting list of param2[i] is
+                    param4[param3[i]:param3[i+1]].
+            param4 [ndarray] of param1 indices in ascending order per bigram.
+            param5 [dict] where key=item & val=textual content.
+        """
+        self.items = np.asarray(items)
+        self.gram_idx = {gram:idx for idx, gram in enumerate(grams)}
+        self.offsets = np.asarray(offsets)
+        self.postings = np.asarray(postings)
+        self.content_dict = content_dict
+
+    def get_candidates(self, keyword):
+        """ Find items which contain every bigram of the keyword.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] untagged keyword.
+        Return:
+            return1 [ndarray] of ascending item indices, a superset of items
+                    containing param1.
+        Note:
+            1) Keywords shorter than a bigram match every item.
+        """
+        if len(keyword) < 2:
+            return np.arange(len(self.items))
+
+        # Step 1: Collect the posting lists of the keyword's bigrams.
+        pl_list = []
+        for gram in set(keyword[i:i+2] for i in range(len(keyword)-1)):
+            if gram not in self.gram_idx:
+                return np.empty(0, dtype=self.postings.dtype)
+            idx = self.gram_idx[gram]
+            pl_list.append(self.postings[self.offsets[idx]:self.offsets[idx+1]])
+
+        # Step 2: Intersect posting lists from the shortest one.
+        pl_list.sort(key=len)
+        cand_indices = pl_list[0]
+        for posting_list in pl_list[1:]:
+            cand_indices = np.intersect1d(cand_indices, posting_list, assume_unique=True)
+
+        return cand_indices
+
+    def count(self, keyword):
+        """ Count the exact occurrences of a keyword in each item's content.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] untagged keyword.
+        Return:
+            return1 [dict] where key=item containing param1 & val=number of
+                    non-overlapping occurrences, as str.count.
+        """
+        ic_dict = {} # return1
+
+        for item in self.items[self.get_candidates(keyword)].tolist():
+            count = self.content_dict[item].count(keyword)
+            if count > 0:
+                ic_dict[item] = count
+
+        return ic_dict
+
+    def save(self, path):
+        """ Save the index, without the textual content, as a .npz file.
+        Param:
+            param0 [self] reference to this object.
+            param1 [string] path to save the index.
+        """
+        grams = sorted(self.gram_idx, key=self.gram_idx.get)
+        np.savez(path, items=self.items, grams=np.array(grams),
+                offsets=self.offsets, postings=self.postings)
+
+
+class PopularityRanker():
+    """
+    Store items pre-sorted descendingly by popularity for repeated top-k
+    popularity retrieval over different candidate sets.
+    """
+
+    def __init__(self, popularity_dict):
+        """ Constructor for PopularityRanker.
+        Param:
+            param0 [self] reference to this object.
+            param1 [dict] where key=item & val=popularity.
+        Note:
+            1) Ties are ordered by param1 insertion order, as in
+                Counter.most_common().
+        """
+        self.items = list(popularity_dict.keys())
+        scores = np.array(list(popularity_dict.values()))
+        self.order = np.argsort(-scores, kind='stable') # item ids by popularity
+        self.ranked_items = [self.items[idx] for idx in self.order]
+        self.item_idx = {item:idx for idx, item in enumerate(self.items)}
+        self.ranks = np.empty(len(self.items), dtype=np.int64) # popularity rank of each item id
+        self.ranks[self.order] = np.arange(len(self.items))
+
+    def generate_mask(self, cand_list):
+        """ Generate the candidate mask over item ids for retrieve.
+        Param:
+            param0 [self] reference to this object.
+            param1 [list] of candidate items.
+        Return:
+            return1 [ndarray] of bool s.t. True marks an item id in param1.
+        """
+        mask = np.zeros(len(self.items), dtype=bool)
+        mask[[self.item_idx[cand] for cand in cand_list if cand in self.item_idx]] = True
+        return mask
+
+    def retrieve(self, quota, cand):
+        """ Retrieve the top-k most popular candidates.
+        Param:
+            param0 [self] reference to this object.
+            param1 [int] number of items to retrieve.
+            param2 [set|ndarray] of candidate items, or a bool mask over item
+                    ids from generate_mask.
+        Return:
+            return1 [list] of retrieved items ordered descendingly by
+                    popularity.
+        Note:
+            1) Only the quota and the skipped non-candidates are visited.
+        """
+        result_list = [] # return1
+
+        # Step 1: Walk a candidate set item by item.
+        if not isinstance(cand, np.ndarray):
+            for item in self.ranked_items:
+                if len(result_list) >= quota:
+                    break
+                if item in cand:
+                    result_list.append(item)
+            return result_list
+
+        # Step 2: Walk a candidate mask in growing chunks of ranked ids.
+        start, chunk_size = 0, max(quota, 64)
+        while len(result_list) < quota and start < len(self.order):
+            ids = self.order[start:start+chunk_size]
+            result_list += [self.items[idx] for idx in ids[cand[ids]]]
+            start += chunk_size
+            chunk_size *= 2
+
+        return result_list[:max(quota, 0)]
 
 
 def retrieve_by_random(quota, cand_list):
@@ -70,103 +586,174 @@ def retrieve_by_popularity(quota, cand_list, popularity_dict):
     Param:
         param1 [int] number of items to retrieve.
         param2 [list] of candidate items.
-        param3 [dict] where key=item & val=popularity.
+        param3 [dict|PopularityRanker] where key=item & val=popularity.
     Return:
         return1 [list] of retrieved items ordered descendingly by popularity.
+    Note:
+        1) Pass a PopularityRanker to sort by popularity only once across
+            calls.
     """
-    result_list = [] # return1
-    
     # Step 1: Descendingly sort the songs by popularity.
-    item_list = [i for (i,_) in Counter(popularity_dict).most_common()]
+    if isinstance(popularity_dict, PopularityRanker):
+        ranker = popularity_dict
+    else:
+        ranker = PopularityRanker(popularity_dict)
 
     # Step 2: Retrieve the top-k most popular items.
-    for item in item_list:
-        if len(result_list) >= quota:
-            break
-        if item in cand_list:
-            result_list.append(item)
+    result_list = ranker.retrieve(quota, set(cand_list)) # return1
         
     return result_list
 
 
-def retrieve_by_keyword(quota, query_list, cand_list, content_dict):
+def retrieve_by_keyword(quota, query_list, cand_list, content_dict, keyword_index=None):
     """ Retrieve the top-k items with the most query occurrences counts.
     Param:
         param1 [int] number of items to retrieve.
         param2 [list] of queries.
         param3 [list] of candidate items.
         param4 [dict] where key=retrieved item & val=textual content.
+        param5 [KeywordIndex] built over param4 to count occurrences without
+                scanning every candidate. Default=None.
     Return:
         return1 [list] of retrieved items ordered descendingly by the number of
                 query occurrences.
     Note:
         1) Similarity calculated by counting query occurrences in the textual
             content without segmentation.
+        2) Ties, including items without any occurrence, are ordered by their
+            first position in param3 with or without param5.
     """
     # Step 1: Construct the occurrence count look-up table.
-    inv_idx = {}
-    for cand in cand_list:
-        if cand in content_dict: # textual content exists
-            inv_idx[cand] = 0
-            
-            for query in query_list:
-                inv_idx[cand] += content_dict[cand].count(query[1:])
+    if keyword_index is None:
+        inv_idx = {}
+        for cand in cand_list:
+            if cand in content_dict: # textual content exists
+                inv_idx[cand] = 0
+                
+                for query in query_list:
+                    inv_idx[cand] += content_dict[cand].count(query[1:])
 
     # Step 2: Retrieve the top-k items with the most keyword-matching frequency.
-    result_list = [i for (i,_) in Counter(inv_idx).most_common(quota)] # return1
+        result_list = [i for (i,_) in Counter(inv_idx).most_common(quota)] # return1
         
+        return result_list
+
+    # Step 1 (indexed): Count occurrences only in items holding the queries.
+    count_dict = Counter()
+    for query in query_list:
+        count_dict.update(keyword_index.count(query[1:]))
+
+    # Step 2 (indexed): Rank matched candidates w/ a heap, ties by position.
+    pos_dict = {}
+    for pos, cand in enumerate(cand_list):
+        if cand in content_dict and cand not in pos_dict:
+            pos_dict[cand] = pos
+    match_list = [(-count, pos_dict[item], item) for item, count in count_dict.items() if item in pos_dict]
+    result_list = [item for (_,_,item) in heapq.nsmallest(quota, match_list)] # return1
+
+    # Step 3 (indexed): Fill up the quota with unmatched candidates.
+    if len(result_list) < quota:
+        for cand in pos_dict: # in candidate order
+            if len(result_list) >= quota:
+                break
+            if cand not in count_dict:
+                result_list.append(cand)
+
     return result_list
 
 
-def retrieve_by_repr(quota, query_list, qr_dict, rec_mat, metric="cosine"):
+def retrieve_by_repr(quota, query_list, qr_dict, rec_mat, metric="cosine", ann_index=None):
     """ Retrieve the top-k items most similar to the query in terms of
         representation.
     Param:
         param1 [int] number of items to retrieve.
         param2 [list] of queries.
-        param3 [dict] where key=query & val=representation.
+        param3 [dict|IndexedMatrix] where key=query & val=representation.
         param4 [IndexedMatrix] of items.
         param5 [string] distance metric from sklearn.metrics, e.g. "cosine" &
-                "euclidean". Default="cosine".
+                "euclidean", or "dot_product". Default="cosine".
+        param6 [IVFIndex] built over param4 to retrieve approximately instead
+                of exactly. Default=None.
     Return:
         return1 [list] of retrieved items ordered descendingly by representation
                 similarity.
+    Note:
+        1) Only the top-k items of each query are scored in full, as any
+            item beyond a query's k-th is never reached before the quota.
     """
-    result_list = [] # return1
-    
     query_mat = generate_indexed_matrix(query_list, qr_dict)
         
-    # Step 1: Calculate the distance b/t user queries and candidate items.
-    dist_mat = calculate_repr_distance(query_mat, rec_mat, metric)
+    # Step 1: Find each query's top-k candidate items ordered by distance.
+    if ann_index is None:
+        order_mat, dist_mat = rec_mat.top_k(query_mat.repr_matrix, quota, metric)
+    else:
+        order_mat, dist_mat = ann_index.search(query_mat.repr_matrix, quota, metric)
 
-    # Step 2: Order each query's candidate items by disance.
-    order_mat = np.asarray([sl.argsort() for sl in dist_mat])
+    # Step 2: Order candidate items level-wise, i.e. by rank across queries
+    # and then by distance within the same rank.
+    rank_mat = np.broadcast_to(np.arange(order_mat.shape[1]), order_mat.shape)
+    level_order = np.lexsort((dist_mat.ravel(), rank_mat.ravel()))
+    rec_indices = order_mat.ravel()[level_order]
 
-    # Step 3: Order same-level candidate items across queries by distance.
-    for col_indices in order_mat.T: # move horizontally across rec items
-        col_scores = np.asarray([dist_mat[idx][rec_idx] for idx, rec_idx in enumerate(col_indices)])
-        query_order = col_scores.argsort()
-        
-    # Step 4: Levelwise retrieve the top-k items closest to queries.
-        for query_idx in query_order: # move vertically across queries
-            if len(result_list) >= quota: # handle neg top_k
-                break
-                
-            rec_idx = col_indices[query_idx]
-            rec_item = rec_mat.items[rec_idx]
-	
-            if rec_item not in result_list:
-                result_list.append(rec_item)
+    # Step 3: Levelwise retrieve the top-k distinct items closest to queries.
+    _, first_pos = np.unique(rec_indices, return_index=True) # 1st occurrences
+    rec_indices = rec_indices[np.sort(first_pos)][:max(quota, 0)]
+    result_list = rec_mat.items[rec_indices].tolist() # return1
             
     return result_list
 
 
+def retrieve_batch(quota, query_list, qr_dict, rec_mat, metric="cosine", ann_index=None, query_block=1024):
+    """ Retrieve the top-k items most similar to each query separately, scoring
+        all queries against the items in one batch.
+    Param:
+        param1 [int] number of items to retrieve per query.
+        param2 [list] of queries.
+        param3 [dict|IndexedMatrix] where key=query & val=representation.
+        param4 [IndexedMatrix] of items.
+        param5 [string] distance metric, see retrieve_by_repr.
+                Default="cosine".
+        param6 [IVFIndex] built over param4 to retrieve approximately instead
+                of exactly. Default=None.
+        param7 [int] number of queries scored per batch. Default=1024.
+    Return:
+        return1 [list] of lists of retrieved items ordered descendingly by
+                representation similarity, one list per query.
+    Note:
+        1) Same as calling retrieve_by_repr with each single query, but
+            replaces many small matrix products with a few large ones.
+        2) Queries without repr in param3 retrieve an empty list.
+        3) Only param7 queries are gathered & scored at a time, so memory
+            does not grow with the length of param2.
+    """
+    avail_queries = [query for query in query_list if query in qr_dict]
+    ri_dict = {}
+    query_block = max(query_block, 1)
+
+    for start in range(0, len(avail_queries), query_block):
+        # Step 1: Gather the repr of a batch of queries that have one.
+        batch_queries = avail_queries[start:start+query_block]
+        query_mat = generate_indexed_matrix(batch_queries, qr_dict)
+
+        # Step 2: Find the top-k items of the batch at once.
+        if ann_index is None:
+            order_mat, _ = rec_mat.top_k(query_mat.repr_matrix, quota, metric)
+        else:
+            order_mat, _ = ann_index.search(query_mat.repr_matrix, quota, metric)
+        ri_dict.update({query:rec_mat.items[order].tolist() for query, order in zip(batch_queries, order_mat)})
+
+    # Step 3: Align results with queries.
+    rl_list = [ri_dict.get(query, []) for query in query_list] # return1
+
+    return rl_list
+
+
 def generate_indexed_matrix(items, repr_dict):
     """ Initialize an IndexedMatrix object with specified item list and provided
         representation dictionary.
     Param:
         param1 [list] of specified items.
-        param2 [dict] where key=item & val=repr.
+        param2 [dict|IndexedMatrix] where key=item & val=repr.
     Return:
         return1 [IndexedMatrix] obj.
     """
@@ -195,3 +782,180 @@ def calculate_repr_distance(query_mat, rec_mat, metric="cosine"):
     return dist_mat
 
 
+def generate_ivf_index(rec_mat, list_num, metric="cosine", iter_num=10, sample_num=None, probe_num=8, seed=None, block_size=65536):
+    """ Build an IVFIndex by clustering the rows of an IndexedMatrix with
+        k-means and grouping rows by their closest centroid.
+    Param:
+        param1 [IndexedMatrix] of items to index.
+        param2 [int] number of inverted lists, i.e. k-means clusters.
+        param3 [string] distance metric, "cosine", "dot_product" or
+                "euclidean". Default="cosine".
+        param4 [int] number of k-means iterations. Default=10.
+        param5 [int] number of rows sampled to train k-means.
+                Default=64*param2.
+        param6 [int] default number of inverted lists probed per query.
+                Default=8.
+        param7 [int] seed for sampling rows and initial centroids.
+                Default=None.
+        param8 [int] number of rows assigned at a time. Default=65536.
+    Return:
+        return1 [IVFIndex] obj.
+    Note:
+        1) Rows are unit-normalized before clustering for "cosine" and
+            "dot_product", i.e. spherical k-means.
+    """
+    if rec_mat.repr_matrix is None:
+        raise ValueError("IVFIndex needs the float32 repr of its items")
+    rs = np.random.RandomState(seed)
+    row_num = len(rec_mat.repr_matrix)
+    list_num = max(1, min(list_num, row_num))
+    if sample_num is None:
+        sample_num = 64*list_num
+    sample_num = max(list_num, min(sample_num, row_num))
+    unit_norm = metric in ("cosine", "dot_product")
+
+    def get_vectors(rows): # rows in the clustering space
+        vectors = np.asarray(rec_mat.repr_matrix[rows], dtype=np.float32)
+        if unit_norm:
+            vectors = vectors / rec_mat.get_row_norms()[rows][:, None]
+        return vectors
+
+    # Step 1: Sample training rows and initial centroids.
+    sample = get_vectors(np.sort(rs.choice(row_num, sample_num, replace=False)))
+    centroids = sample[rs.choice(sample_num, list_num, replace=False)].copy()
+
+    # Step 2: Refine centroids with k-means.
+    for _ in range(iter_num):
+        assign = calculate_centroid_distance(sample, centroids, metric).argmin(axis=1)
+        counts = np.bincount(assign, minlength=list_num)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled][:, None]
+        centroids[~filled] = sample[rs.choice(sample_num, (~filled).sum())] # reseed empty lists
+        if unit_norm:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids /= norms
+
+    # Step 3: Assign every row to its closest centroid block by block.
+    assign = np.empty(row_num, dtype=np.int64)
+    for start in range(0, row_num, block_size):
+        end = min(start+block_size, row_num)
+        assign[start:end] = calculate_centroid_distance(get_vectors(slice(start, end)), centroids, metric).argmin(axis=1)
+
+    # Step 4: Group rows by inverted list.
+    rows = np.argsort(assign, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=list_num))])
+
+    return IVFIndex(rec_mat, centroids, offsets, rows, metric, probe_num)
+
+
+def load_ivf_index(path, rec_mat):
+    """ Load an IVFIndex saved by IVFIndex.save.
+    Param:
+        param1 [string] path to the .npz index file.
+        param2 [IndexedMatrix] the index was built over.
+    Return:
+        return1 [IVFIndex] obj.
+    """
+    with np.load(path) as data:
+        return IVFIndex(rec_mat, data['centroids'], data['offsets'],
+                data['rows'], str(data['metric']), int(data['probe_num']))
+
+
+def calculate_centroid_distance(query_matrix, centroids, metric="cosine"):
+    """ Calculate the distance between queries and IVF centroids.
+    Param:
+        param1 [ndarray] of queries, one per row.
+        param2 [ndarray] of centroids, one per row.
+        param3 [string] distance metric. Default="cosine".
+    Return:
+        return1 [ndarray] of distances b/t every query and centroid.
+    Note:
+        1) Centroids of "cosine" and "dot_product" indexes are unit vectors, so
+            both are ordered by negative dot product.
+    """
+    if metric in ("cosine", "dot_product"):
+        return -np.dot(query_matrix, centroids.T)
+    else:
+        return pairwise_distances(query_matrix, centroids, metric)
+
+
+def generate_keyword_index(content_dict):
+    """ Build a KeywordIndex of the character bigrams in every item's content.
+    Param:
+        param1 [dict] where key=item & val=textual content.
+    Return:
+        return1 [KeywordIndex] obj.
+    """
+    items = list(content_dict.keys())
+    gp_dict = {} # key=bigram & val=array of item indices
+
+    print("Indexing keywords of:\t", len(items), "items")
+    for item_idx, item in enumerate(items):
+        content = content_dict[item]
+        for gram in set(content[i:i+2] for i in range(len(content)-1)):
+            if gram in gp_dict:
+                gp_dict[gram].append(item_idx)
+            else:
+                gp_dict[gram] = array('i', [item_idx])
+
+    grams = list(gp_dict.keys())
+    offsets = np.zeros(len(grams)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(gp_dict[gram]) for gram in grams])
+    postings = np.empty(offsets[-1], dtype=np.int32)
+    for idx, gram in enumerate(grams):
+        postings[offsets[idx]:offsets[idx+1]] = gp_dict.pop(gram)
+    print("Number of bigrams:\t", len(grams), end='\n\n')
+
+    return KeywordIndex(items, grams, offsets, postings, content_dict)
+
+
+def load_keyword_index(path, content_dict):
+    """ Load a KeywordIndex saved by KeywordIndex.save.
+    Param:
+        param1 [string] path to the .npz index file.
+        param2 [dict] where key=item & val=textual content the index was built
+                over.
+    Return:
+        return1 [KeywordIndex] obj.
+    """
+    with np.load(path) as data:
+        return KeywordIndex(data['items'], data['grams'].tolist(),
+                data['offsets'], data['postings'], content_dict)
+
+
+def generate_degree_ranker(el_dict):
+    """ Build a PopularityRanker which uses node degrees in an edge list as
+        popularity, e.g. song degrees in the SL graph.
+    Param:
+        param1 [dict] where key=tagged node & val=list of assoc nodes.
+    Return:
+        return1 [PopularityRanker] obj.
+    """
+    return PopularityRanker({node:len(assoc_nodes) for node, assoc_nodes in el_dict.items()})
+
+
+def quantize_indexed_matrix(rec_mat, mode="int8", rescore_factor=4, keep_repr=True):
+    """ Convert an IndexedMatrix to a QuantizedIndexedMatrix which shares its
+        items and repr.
+    Param:
+        param1 [IndexedMatrix] of items.
+        param2 [string] quantization mode, "float16" or "int8".
+                Default="int8".
+        param3 [int] shortlist size as a multiple of k for exact re-scoring.
+                Default=4.
+        param4 [bool] whether to keep the float32 repr for exact re-scoring,
+                see QuantizedIndexedMatrix. Default=True.
+    Return:
+        return1 [QuantizedIndexedMatrix] obj.
+    Note:
+        1) With param4=False, drop other references to param1 to free its
+            float32 repr.
+    """
+    quant_mat = QuantizedIndexedMatrix(rec_mat.items, rec_mat.repr_matrix, mode, rescore_factor,
+            keep_repr=keep_repr)
+
+    return quant_mat
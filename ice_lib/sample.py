@@ -22,15 +22,19 @@
 #       1) sample_queries                   2) convert_query_local_tfidf
 #       3) convert_query_global_tfidf       4) split_joint_queries
 #       5) save_joint_queries               6) load_joint_queries
+#       7) generate_query_shard             8) save_joint_query_shards
+#       9) iterate_joint_query_shards
 
 
+import heapq
+import concurrent.futures
 import numpy as np
-from collections import Counter
-from random import shuffle
-from preprocess import *
+from array import array
+from itertools import repeat
+from ice_lib.preprocess import *
 
 
-def sample_queries(user_quota, query_dict_list, query_quota, train_dict):
+def sample_queries(user_quota, query_dict_list, query_quota, train_dict, seed=None):
     """ Sample queries s.t. every user has sufficient samples for each type of
         queries.
     Param:
@@ -39,35 +43,48 @@ def sample_queries(user_quota, query_dict_list, query_quota, train_dict):
                 key=user & val=list of query candidates. 
         param3 [int] num of queries to sample per user.
         param4 [dict] where key=user & val=list of user's training items.
+        param5 [int|np.random.Generator] seed or generator for sampling.
+                Default=None, i.e. fresh OS entropy.
     Return:
         return1 [list] of dict corresponding to different types of queries,
                 where key=user & val=2-tuple of the list of queries and the list
                 of blacklist items.
+    Note:
+        1) The same param5 yields the same users & queries, in the same order.
+        2) Query lists in param2 are NOT shuffled in place.
     """
     ut_dict_list = [] # return1
-    
+    rng = np.random.default_rng(seed)
+    users = list(query_dict_list[0].keys())
+
     # Step 1: Remove users with insufficient queries for any query type.
-    sampled_users = list(query_dict_list[0].keys())
-    for s_user in sampled_users:
-        for query_dict in query_dict_list: # across query types
-            if len(query_dict[s_user]) < query_quota: # insufficient queries
-                sampled_users.remove(s_user)
-                break
-    
+    len_list = [np.fromiter((len(query_dict[user]) for user in users), dtype=np.int64, count=len(users))
+            for query_dict in query_dict_list] # across query types
+    valid_idx = np.flatnonzero(np.minimum.reduce(len_list) >= query_quota) if users else np.array([], dtype=np.int64)
+
     # Step 2: Sample users.
-    shuffle(sampled_users) # avoid seq sampling
-    sampled_users = sampled_users[:user_quota]
-        
-    # Step 3: Sample queries for each user.
-    for query_dict in query_dict_list:
+    user_idx = rng.permutation(valid_idx)[:max(user_quota, 0)] # avoid seq sampling
+    sampled_users = [users[idx] for idx in user_idx.tolist()]
+
+    # Step 3: Sample queries for each user in bulk, i.e. order each user's
+    # queries by random keys and keep the first param3 of them.
+    quota = max(query_quota, 0)
+    for query_dict, lengths in zip(query_dict_list, len_list):
         ut_dict = {} # return1
-        for s_user in sampled_users:
+        lengths = lengths[user_idx]
+        starts = np.zeros(len(lengths), dtype=np.int64)
+        starts[1:] = np.cumsum(lengths)[:-1]
+
+        segments = np.repeat(np.arange(len(lengths)), lengths)
+        order = np.lexsort((rng.random(len(segments)), segments))
+        pick_mat = order[starts[:, None] + np.arange(quota)] - starts[:, None]
+
+        for s_user, picks in zip(sampled_users, pick_mat.tolist()):
             query_list = query_dict[s_user]
-            shuffle(query_list) # avoid seq sampling
-            ut_dict[s_user] = (query_list[:query_quota],train_dict[s_user])
-            
+            ut_dict[s_user] = ([query_list[idx] for idx in picks], train_dict[s_user])
+
         ut_dict_list.append(ut_dict)
-    
+
     return ut_dict_list
 
 
@@ -79,8 +96,8 @@ def convert_query_local_tfidf(query_quota, ut_dict, st_dict):
         param1 [int] num of queries to sample per user.
         param2 [dict] where key=user & val=2-tuple of the list of query songs
                 and the list of training songs.
-        param3 [dict] where key=song & val=2-tuple of the list of lyric words
-                and the list of assoc tfidf scores.
+        param3 [dict|TfidfMatrix] where key=song & val=2-tuple of the list of
+                lyric words and the list of assoc tfidf scores.
     Return:
         return1 [dict] where key=user & val=2-tuple of the list of local
                 top-tfidf lyric-word queries and the list of training songs.
@@ -88,52 +105,77 @@ def convert_query_local_tfidf(query_quota, ut_dict, st_dict):
         1) Query words are ordered basing on tfidf scores within respective
             songs and then across all query songs for selection.
         2) Different songs may have different numbers of assoc lyric words.
+        3) All users are converted in one pass over ragged arrays of their
+            query songs' words; ties keep the song & word order.
     """
     conv_ut_dict = {}
-    
-    for user, (query_songs, train_songs) in ut_dict.items():
+    users = list(ut_dict.keys())
+    word_idx = {} # key=word & val=word id
 
-        words_list = [st_dict[qs][0] for qs in query_songs]
-        scores_list = [st_dict[qs][1] for qs in query_songs] 
-        
-        # Step 1: Pad score lists to the same length.
-        max_len = max(len(wl) for wl in words_list)
-        score_mat = -np.array([scores + (max_len-len(scores))*[float('-inf')] for scores in scores_list])
-
-        # Step 2: Generate order for each song's lyric words.
-        order_mat = np.asarray([sl.argsort() for sl in score_mat])
-                                                          
-        # Step 3: Order same-level words across songs by tfidf score.
-        query_words = []
-        for col_indices in order_mat.T: # move horizontally across words
-            col_scores = np.asarray([score_mat[idx][word_idx] for idx, word_idx in enumerate(col_indices)])
-            song_order = col_scores.argsort()
-
-        # Step 4: Select local top-tfidf words level-wise as queries.
-            for song_idx in song_order: # move vertically across songs
-                if len(query_words) >= query_quota: # handle neg param1
-                    break
-                        
-                word_idx = col_indices[song_idx]
-                if score_mat[song_idx][word_idx] != float('inf'): # skip padding
-                    query_word = words_list[song_idx][word_idx]
-                    if query_word not in query_words:
-                        query_words.append(query_word)
-                    
-        conv_ut_dict[user] = (query_words, train_songs)
+    # Step 1: Concatenate all query songs' words & scores as ragged arrays.
+    word_ids = array('q')
+    scores = array('d')
+    song_lens = array('q') # words per query song
+    user_lens = array('q') # query songs per user
+    for user in users:
+        query_songs = ut_dict[user][0]
+        user_lens.append(len(query_songs))
+        for qs in query_songs:
+            words, song_scores = st_dict[qs]
+            word_ids.extend([word_idx.setdefault(w, len(word_idx)) for w in words])
+            scores.extend(song_scores)
+            song_lens.append(len(words))
+
+    word_ids = np.frombuffer(word_ids, dtype=np.int64)
+    neg_scores = -np.frombuffer(scores, dtype=np.float64)
+    song_lens = np.frombuffer(song_lens, dtype=np.int64)
+    user_lens = np.frombuffer(user_lens, dtype=np.int64)
+
+    song_starts = np.concatenate([[0], np.cumsum(song_lens)[:-1]]).astype(np.int64)
+    user_starts = np.concatenate([[0], np.cumsum(user_lens)[:-1]]).astype(np.int64)
+    entry_songs = np.repeat(np.arange(len(song_lens)), song_lens)
+    song_users = np.repeat(np.arange(len(users)), user_lens)
+    song_pos = np.arange(len(song_lens)) - user_starts[song_users] # within user
+    entry_users = song_users[entry_songs]
+
+    # Step 2: Rank each song's lyric words by tfidf score (segmented sort).
+    order = np.lexsort((neg_scores, entry_songs))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - song_starts[entry_songs[order]]
+
+    # Step 3: Order same-rank words across songs by tfidf score, rank by rank.
+    order = np.lexsort((song_pos[entry_songs], neg_scores, ranks, entry_users))
+    sorted_users = entry_users[order]
+
+    # Step 4: Keep each user's first occurrence of a word up to the quota.
+    _, firsts = np.unique(sorted_users*max(len(word_idx), 1) + word_ids[order], return_index=True)
+    firsts.sort()
+    kept_users = sorted_users[firsts]
+    kept_starts = np.searchsorted(kept_users, np.arange(len(users)))
+    firsts = firsts[np.arange(len(firsts)) - kept_starts[kept_users] < max(query_quota, 0)] # handle neg param1
+    kept_counts = np.bincount(sorted_users[firsts], minlength=len(users))
+
+    # Step 5: Map word ids back to words per user.
+    words = list(word_idx.keys())
+    kept_words = [words[w_id] for w_id in word_ids[order[firsts]].tolist()]
+    kept_ends = np.cumsum(kept_counts).tolist()
+    for user, start, end in zip(users, [0] + kept_ends[:-1], kept_ends):
+        conv_ut_dict[user] = (kept_words[start:end], ut_dict[user][1])
 
     return conv_ut_dict
 
 
-def convert_query_global_tfidf(query_quota, ut_dict, st_dict):
+def convert_query_global_tfidf(query_quota, ut_dict, st_dict, rank_dict=None):
     """ Convert song queries to word queries by selecting their lyrical words
         with the highest tfidf score summed across all available songs.
     Param:
         param1 [int] num of queries to sample per user.
         param2 [dict] where key=user & val=2-tuple of the list of query songs
                 and the list of training songs.
-        param3 [dict] where key=song & val=2-tuple of the list of lyric words
-                and the list of assoc tfidf scores.
+        param3 [dict|TfidfMatrix] where key=song & val=2-tuple of the list of
+                lyric words and the list of assoc tfidf scores.
+        param4 [dict] returned by generate_global_tfidf_rank on param3.
+                Default=None, i.e. ranked here.
     Return:
         return1 [dict] where key=user & val=2-tuple of the list of global
                 top-tfidf lyric-word queries and the list of training songs.
@@ -141,22 +183,23 @@ def convert_query_global_tfidf(query_quota, ut_dict, st_dict):
         1) Query words are ordered basing on tfidf scores across all available
             songs and then across all query songs for selection.
         2) Different songs may have different numbers of assoc lyric words.
+        3) Pass param4 to share the global ranking across calls.
     """
     conv_ut_dict = {}
     
-    # Step 1: Construct dict of word & global tfidf score sum.
-    tfidf_dict = generate_global_tfidf_dict(st_dict) # @ may be done outside
+    # Step 1: Rank words by global tfidf score sum.
+    if rank_dict is None:
+        rank_dict = generate_global_tfidf_rank(st_dict)
+    ranked_words = [None]*len(rank_dict)
+    for word, rank in rank_dict.items():
+        ranked_words[rank] = word
     
-    # Step 2: Collect all words from query songs.
+    # Step 2: Collect ranks of all words from query songs.
     for user, (query_songs,train_songs) in ut_dict.items():
-        word_list = []
-        for query_song in query_songs:
-            word_list += st_dict[query_song][0]
-        word_list = list(set(word_list)) # remove dup
+        rank_set = {rank_dict[w] for query_song in query_songs for w in st_dict[query_song][0]}
         
     # Step 3: Select global top-tfidf words as queries.
-        filt_tfidf_dict = {w:tfidf_dict[w] for w in word_list}
-        query_words = [w for (w,_) in Counter(filt_tfidf_dict).most_common(query_quota)]
+        query_words = [ranked_words[rank] for rank in heapq.nsmallest(max(query_quota, 0), rank_set)]
         conv_ut_dict[user] = (query_words, train_songs)
         
     return conv_ut_dict
@@ -241,3 +284,103 @@ def load_joint_queries(name_list, path, lb, ub):
         ut_dict_list.append(ut_dict)
     
     return ut_dict_list
+
+
+def generate_query_shard(ut_dict, vocab):
+    """ Encode a query dict as ragged int32 id arrays over a shared Vocabulary.
+    Param:
+        param1 [dict] where key=user & val=2-tuple of the list of queries and
+            the list of training items.
+        param2 [Vocabulary] shared by the users, queries & items of all shards.
+    Return:
+        return1 [dict] of arrays, i.e. user ids and, for queries & training
+            items, offsets s.t. user i owns ids[offsets[i]:offsets[i+1]].
+    """
+    def encode(tokens): # look up in C, then register only the misses
+        ids = np.fromiter(map(vocab.token_idx.get, tokens, repeat(-1)), dtype=np.int32, count=len(tokens))
+        for idx in np.flatnonzero(ids < 0).tolist():
+            ids[idx] = vocab.add(tokens[idx])
+        return ids
+
+    shard_dict = {'users':encode(list(ut_dict.keys()))} # return1
+
+    for field, col in (('queries', 0), ('train_items', 1)):
+        item_lists = [val[col] for val in ut_dict.values()]
+        offsets = np.zeros(len(item_lists)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(il) for il in item_lists])
+        shard_dict[field + '_offsets'] = offsets
+        shard_dict[field + '_ids'] = encode([item for il in item_lists for item in il])
+
+    return shard_dict
+
+
+def save_joint_query_shards(ut_dl_list, name_list, path, worker_num=None, compress=False):
+    """ Save joint-split queries as auto-numbered .npz shards of int32 ids over
+        one shared vocabulary, writing shards in parallel.
+    Param:
+        param1 [list] of lists of dict where key=user & val=2-tuple of the list
+            of queries and the list of training items.
+        param2 [list] of names for the query files.
+        param3 [string] path to the directory to save the query shards.
+        param4 [int] number of writer threads. Default=None, i.e. the
+            executor's.
+        param5 [bool] whether to zip-compress shards, i.e. smaller but slower
+            to write. Default=False.
+    Note:
+        1) Shards are named as in save_joint_queries plus ".npz", and the
+            vocabulary is saved as "query_vocab.json".
+        2) Shards are encoded in this process and written by threads, so no
+            query dict is pickled to a worker.
+    """
+    vocab = Vocabulary()
+    save_npz = np.savez_compressed if compress else np.savez
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_num) as executor:
+        future_list = []
+        for serial_num, ut_dict_list in enumerate(ut_dl_list):
+            for name, ut_dict in zip(name_list, ut_dict_list):
+                shard_dict = generate_query_shard(ut_dict, vocab)
+                future_list.append(executor.submit(save_npz, path + name + str(serial_num) + ".npz", **shard_dict))
+
+        for future in concurrent.futures.as_completed(future_list):
+            future.result() # raise writer errors
+
+    with open(path + "query_vocab.json", 'w', encoding='utf-8') as f:
+        json.dump(vocab.tokens, f, ensure_ascii=False)
+
+
+def iterate_joint_query_shards(name_list, path, lb, ub):
+    """ Lazily load joint-split .npz query shards between specified bounds, one
+        user at a time.
+    Param:
+        param1 [list] of names of query shards (w/o serial number) to load.
+        param2 [string] path to load the query shards.
+        param3 [int] lower bound serial number to start loading query shards.
+        param4 [int] upper-bound serial number to end loading query shards.
+    Return:
+        return1 [generator] of 2-tuple of user and list of 2-tuple of the list
+            of queries and the list of training items, one per param1 name.
+    Note:
+        1) Joint queries are sampled from the same set of users, in the same
+            order across param1 shards of a serial number.
+        2) param4 is inclusive.
+        3) Only one serial number's shards are decoded & held at a time.
+    """
+    with open(path + "query_vocab.json", encoding='utf-8') as f:
+        tokens = np.array(json.load(f), dtype=object)
+
+    for serial_num in range(lb, ub+1):
+        # Step 1: Decode one serial number's shards at once.
+        users = None
+        qt_lists = [] # per name: 4-tuple of decoded queries & items and offsets
+        for name in name_list:
+            with np.load(path + name + str(serial_num) + ".npz") as shard:
+                if users is None:
+                    users = tokens[shard['users']].tolist()
+                qt_lists.append((tokens[shard['queries_ids']].tolist(), shard['queries_offsets'].tolist(),
+                        tokens[shard['train_items_ids']].tolist(), shard['train_items_offsets'].tolist()))
+
+        # Step 2: Yield users one at a time.
+        for u_idx, user in enumerate(users or []):
+            yield (user, [(queries[q_offsets[u_idx]:q_offsets[u_idx+1]], train_items[t_offsets[u_idx]:t_offsets[u_idx+1]])
+                    for queries, q_offsets, train_items, t_offsets in qt_lists])
@@ -67,13 +67,14 @@ synonym_path = graph_path + top + "/" + "post_uniq/" + "ll_" + top + "x3.edge"
 
 # Step 2: Load dicts.
 print("\nLoad metadata:")
-metadata_dict = load_song_metadata_dict(metadata_path, 's')
+metadata_dict = load_song_metadata_store(metadata_path, 's') # decodes ONLY retrieved songs
 print("Load lyric dict:")
 lyric_dict = load_lyric_dict(lyric_path, 's')
+keyword_index = generate_keyword_index(lyric_dict) # built once for KBR & evaluation
 print("Load available songs:")
-avail_song_list = list(load_el_by_tag(latest_song_path, 's', True).keys())
+avail_song_list = list(load_csr_by_tag(latest_song_path, 's', True).keys())
 print("Load synonym dict:")
-syn_dict = load_el_by_tag(synonym_path, 'w', True) # load LL edge list
+syn_dict = load_csr_by_tag(synonym_path, 'w', True) # load LL edge list
 
 # Load repr dicts.
 if mod!=mod_list[0] and mod!=mod_list[1]:
@@ -82,11 +83,10 @@ if mod!=mod_list[0] and mod!=mod_list[1]:
     else: 
         repr_tag = 'w'
 
-    print("Loading lyric repr:")
-    lyric_repr_dict = load_repr_by_tag(repr_path, repr_tag, 1)
-    print("Loading song repr:")
-    song_repr_dict = load_repr_by_tag(repr_path, 's', 1)
-    rec_mat = generate_indexed_matrix(list(song_repr_dict.keys()), song_repr_dict)
+    print("Loading lyric & song repr:")
+    repr_mat_dict = load_repr_matrices(repr_path, [repr_tag, 's'], 1)
+    lyric_repr_dict = repr_mat_dict[repr_tag]
+    rec_mat = repr_mat_dict['s']
 
 
 #	SECTION 3: Conduct the retrieval task.
@@ -94,40 +94,41 @@ query_list = ['w失落', 'w心痛', 'w想念', 'w深愛', 'w難過', 'w回家',
         'w海邊', 'w火車', 'w花園', 'w夕陽', 'w日出', 'w日落', 'w月亮', 'w黑夜']
 
 rl_list = [] # list of rec list
-for query in query_list:
-    # Step 1: Random.
-    if mod == "rand":
-         songs = retrieve_by_random(quo, avail_song_list)
-        
-    # Step 2: Keyword-matching.
-    elif mod == "km":
-        songs = retrieve_by_keyword(quo, [query], avail_song_list, lyric_dict)
-
-    # Step 3: Representation, i.e. w2v, sl, sll, sll_exp, sll_nxm, w2v_exp
-    else:
-        if mod=="sll_exp_":
-            query = "exp_w" + query[1:] # replace 'w' tag with 'exp_w' tag
-        if query in lyric_repr_dict: # Rec ONLY if repr exists.
-            songs = retrieve_by_repr(quo, [query], lyric_repr_dict, rec_mat)
+if mod == "rand" or mod == "km":
+    for query in query_list:
+        # Step 1: Random.
+        if mod == "rand":
+             songs = retrieve_by_random(quo, avail_song_list)
+            
+        # Step 2: Keyword-matching.
         else:
-            songs = []
+            songs = retrieve_by_keyword(quo, [query], avail_song_list, lyric_dict, keyword_index)
+
+        rl_list.append(songs)
 
-    rl_list.append(songs)
+# Step 3: Representation, i.e. w2v, sl, sll, sll_exp, sll_nxm, w2v_exp
+else:
+    if mod=="sll_exp_":
+        repr_query_list = ["exp_w" + q[1:] for q in query_list] # replace 'w' tag with 'exp_w' tag
+    else:
+        repr_query_list = query_list
+    rl_list = retrieve_batch(quo, repr_query_list, lyric_repr_dict, rec_mat) # Rec ONLY if repr exists.
 
 survey_dict = generate_survey_dict(rl_list, query_list, lyric_dict, metadata_dict, syn_dict)
 save_json_obj(survey_dict, survey_path)
+metadata_dict.close()
 
 
 #	SECTION 4: Evaluate results.
 query_num = len(query_list)
-avail_sl_list = [avail_song_list]*query_num # list of lists of available songs
+cont_index = ContainmentIndex(lyric_dict, avail_song_list, "w", keyword_index) # keyword-song bitmaps
 tp_fp_list = [quo]*query_num
 copy_friendly = False
 
 # 5-1: Evaluate query relevance.
 ql_list = [[q] for q in query_list] # list of lists of queries
-tp_list = count_keyword_containment(ql_list, rl_list, lyric_dict, "w" )
-tp_fn_list = count_keyword_containment(ql_list, avail_sl_list, lyric_dict, "w")
+tp_list = count_keyword_containment_by_index(ql_list, rl_list, cont_index)
+tp_fn_list = count_available_containment(ql_list, cont_index)
 
 pretty_print_all(ql_list, tp_list, tp_fp_list, tp_fn_list, copy_friendly)
 
@@ -139,8 +140,8 @@ for q in query_list:
     except KeyError:
         print("Keyword:" + q + "does NOT have synonym!", end="\n")
 
-tp_list = count_keyword_containment(ql_list, rl_list, lyric_dict, "w")
-tp_fn_list = count_keyword_containment(ql_list, avail_sl_list, lyric_dict, "w")
+tp_list = count_keyword_containment_by_index(ql_list, rl_list, cont_index)
+tp_fn_list = count_available_containment(ql_list, cont_index)
 
 pretty_print_all(ql_list, tp_list, tp_fp_list, tp_fn_list, copy_friendly)
 